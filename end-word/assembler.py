@@ -1,18 +1,37 @@
 # Standard imports
-import os, shutil
-import xml.etree.ElementTree as ET
+import os, shutil, tempfile
 
 # Third-party imports
-import docx  # To read docx and extract data
+from docx.shared import Mm, Emu  # To preserve image sizes
+from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_BREAK  # To get paragraph justification types
+from docx.oxml.ns import qn  # For defining and targeting xml elements to change
 from docxcompose.composer import Composer  # Append files together, preserving everything except sections
 from docxtpl import DocxTemplate, InlineImage
 
+# Local imports
+from helpers.archive import open_package, cache_stats, release
+from helpers.docx_stream import DocxStream
+from helpers.word import get_para_data, new_section_cols, section_cols, merge_sections
+from helpers.chart import read_charts, render_charts
+from helpers.sheets import convert_sheets
+from helpers.compact import compact_runs
+from helpers.footnotes import FootnoteCopier
+from styling.word_table import style_tbl
+from styling.run_styles import CharStyleRegistry
+from styling.check_styles import check_styles, block_count, format_issues
+
 class Assembler:
-    def __init__(self, dest, context, backpage, output_path):
+    def __init__(self, dest, context, backpage, output_path, temp_path=None):
         self.dest = dest
         self.context = context
         self.backpage = backpage
         self.output_path = output_path
+        self.temp_path = temp_path or tempfile.mkdtemp()  # Deleted after publishing
+        self.char_styles = CharStyleRegistry(dest)  # Named character styles instead of direct run formatting
+        self.footnotes = FootnoteCopier(dest)  # Footnotes copied through a per-source id index
+        self.fragments = {}  # source -> (first, last + 1) body block of the content it added
+        self.published = False  # publish() merges sections and re-renders dest, after which fragments are stale
+        self.columns = None  # Column count of the current section, read from dest on first use
     # def docx_composer(base, new_docx, new_page=False):
     #     '''Appends a new docx file to a base DocxTemplate object, and returns the object for further
         
@@ -49,30 +68,52 @@ class Assembler:
     def publish(self):
         
         # Finalise destination
-        dest.paragraphs[-1].add_run().add_break(WD_BREAK.PAGE)
-        dest.render(context)
+        sections = merge_sections(self.dest)
+        print(f"Sections: {sections['sections_before']} -> {sections['sections_after']}, "
+              f"document.xml {sections['bytes_before']} -> {sections['bytes_after']} bytes")
+        runs = compact_runs(self.dest)
+        print(f"Runs: {runs['runs_merged']} merged, {runs['props_removed']} redundant properties removed, "
+              f"elements {runs['elements_before']} -> {runs['elements_after']}, "
+              f"document.xml {runs['bytes_before']} -> {runs['bytes_after']} bytes")
+        self.dest.paragraphs[-1].add_run().add_break(WD_BREAK.PAGE)
+        self.dest.render(self.context)
         
         # Finalise backpage
-        backpage_doc = DocxTemplate(backpage)
-        backpage_doc.render(context)
+        backpage_doc = DocxTemplate(open_package(self.backpage).stream())
+        backpage_doc.render(self.context)
         
         # Combine documents
-        composer = Composer(dest)
+        composer = Composer(self.dest)
         composer.append(backpage_doc)
         
         # Save output and delete temp folder with all contents
-        composer.save(output_path)
-        print(f'Saved at {output_path}')
-        shutil.rmtree(temp_path)
+        composer.save(self.output_path)
+        print(f'Saved at {self.output_path}')
+        styled = self.char_styles.report()
+        print(f"Character styles: {styled['runs_styled']} runs share {styled['styles_created']} styles, "
+              f"{styled['props_avoided']} direct properties and ~{styled['bytes_avoided']} bytes of rPr avoided")
+        stats = cache_stats()
+        print(f"Archive cache: {stats['bytes_inflated']} bytes inflated, {stats['bytes_served']} bytes served from cache")
+        shutil.rmtree(self.temp_path)
+        release(self.backpage, *self.fragments)  # Unmap the sources, so they can be edited again
+        self.published = True
 
 
-    def append_xlsx(self, dest, source, heading=None):
-        '''Appends Excel data source to the destination Word doc as a Table
-        
+    def set_columns(self, dest, num_cols):
+        '''Switches the destination to num_cols columns, adding a section break only when the layout changes'''
+        if self.columns is None:
+            self.columns = section_cols(dest)
+        self.columns = new_section_cols(dest, num_cols, current=self.columns)
+
+
+    def append_xlsx(self, dest, source, heading=None, sheets=None, max_workers=None, converted=None):
+        '''Appends Excel data source to the destination Word doc as Tables
+
         Does not dynamically search for table contents.
         Table data must start in cell A1.
-        Only plots one table per Excel workbook.
-        
+        Each worksheet becomes its own table, in sheet order. Sheets are converted in parallel
+        across processes when there is more than one.
+
         Parameters
         ----------
         dest : str
@@ -80,221 +121,197 @@ class Assembler:
         source: str
             The file location of the target Excel source
         heading: str
-            A string that will be printed in the style of Heading 1 above the table in word (default is None)
+            A string that will be printed in the style of Heading 1 above the first table in word (default is None)
+        sheets: str or list
+            Name(s) of the worksheets to append (default is every worksheet)
+        max_workers: int
+            Size of the sheet conversion pool (default is the number of CPUs)
+        converted: list
+            SheetData already converted from source with convert_sheets(), e.g. by the build planner (default is None)
         '''
-        # Sub-functions
-        def xl2doc_color(color_meta):
-            if color_meta is None:
-                return
-            tint = color_meta.tint
-            if color_meta.type == 'theme':
-                theme = color_meta.theme
-                fillcolor = theme_and_tint_to_rgb(wb, theme, tint)
-            elif color_meta.type == 'rgb':
-                ms_rgb = color_meta.rgb
-                fillcolor = ms_rgb_to_hex_rgb(ms_rgb, tint)
-            elif color_meta.type == 'indexed':
-                index = color_meta.indexed
-                ms_rgb = styles.colors.COLOR_INDEX[index]
-                if 'Foreground' in ms_rgb:
-                    ms_rgb = '00000000'  # Black
-                else:
-                    ms_rgb = 'FF000000' # White
-                fillcolor = ms_rgb_to_hex_rgb(ms_rgb, tint)
-                
-            else:
-                raise TypeError(f'Unrecognised color-type: "{color_meta.type}". Check classes')
-            return fillcolor
+        start = block_count(dest)
 
-        
-        def cell_text_runs():
-            '''Copies cell text runs (for subscript and superscript support)
-            '''
-            wb = custom_load_workbook(source) # Related to Excel XML parser module
-            ws = wb.active
-            max_col = ws.dim['col_last']
-            max_row = ws.dim['rw_last']
-            
-            # Store cell contents in an array
-            cell_contents = []
-            
-            ws_range = CellHelpers.build_range(1, max_row,1,max_col)
-            for r_idx, row in enumerate(ws.get_range(ws_range)):
-                row_contents = []
-                for c_idx, cell in enumerate(row):
-                    # Convert cell reference to SharedString pointer
-                    cell_ref = ws.cell(cell.rw, cell.col)
-
-                    # Now we can store the SharedString value
-                    cell_value = cell_ref.value
-                    row_contents.append(cell_value)
-                cell_contents.append(row_contents)
-            
-            # Write cell contents to the docx using add_to_paragraph()
-    #         cell_value.add_to_paragraph(paragraph)
-            
-            return cell_contents
-        
-        
-        # Openpyxl
+        # Cell text runs, formats and merges of every sheet, converted independently
         # Note: openpyxl cannot read/copy charts; it needs to recreate them from source data
-        # Read-only and data-only increases the speed of reading data from workbooks
-        wb = load_workbook(source, data_only=True)
-        
-        table_values = cell_text_runs()
-        
-        # Loop through each worksheet
-        for ws in wb.worksheets:
-
-            # Get dimensions of table in Excel
-            data_vals = np.asarray(tuple(ws.values))  # Will need to add logic to read only the table and not comments
-            table_dim = np.shape(data_vals)
-
-            # Get merged ranges
-            merged_ranges = ws.merged_cells.ranges
-
-            # Store dict of formats
-            src_fmts = {}
-            for r,row in enumerate(ws.rows):
-                for c,cell in enumerate(row):
-                    src_fmts[(r,c)] = {
-                        'bold': cell.font.b,
-                        'italic': cell.font.i,
-                        'name': cell.font.name,
-                        'size': cell.font.size,
-                        'fillColor': xl2doc_color(cell.fill.start_color),
-                        'fontColor': xl2doc_color(cell.font.color),
-                        'horizontal': cell.alignment.horizontal,
-                        'vertical': cell.alignment.vertical,  # can build overrides
-                        'border': {
-                            'top': cell.border.top.style,
-                            'topColor': xl2doc_color(cell.border.top.color),
-                            'bottom': cell.border.bottom.style,
-                            'bottomColor': xl2doc_color(cell.border.bottom.color),
-                            'left': cell.border.left.style,
-                            'leftColor': xl2doc_color(cell.border.left.color),
-                            'right': cell.border.right.style,
-                            'rightColor': xl2doc_color(cell.border.right.color),
-                        }
-                    }
-            # Docx
-            new_section_cols(dest, 1)  # Ensure Word section has only one column
-
-            # Add heading if required
-            if heading:
-                dest.add_paragraph(style='Heading 1').add_run().add_text(heading)
+        sheet_data = converted if converted is not None else convert_sheets(source, sheets, max_workers=max_workers)
+
+        # Docx
+        self.set_columns(dest, 1)  # Ensure Word section has only one column
+
+        # Add heading if required
+        if heading:
+            dest.add_paragraph(style='Heading 1').add_run().add_text(heading)
+
+        for sheet_idx, sheet in enumerate(sheet_data):
+            if sheet_idx > 0:
+                # Word joins tables that touch, so keep a paragraph between them
+                dest.add_paragraph()
 
             # Create, table in word
-            table = dest.add_table(rows=table_dim[0], cols=table_dim[1])
-            
+            table = dest.add_table(rows=sheet.shape[0], cols=sheet.shape[1])
+
             # Merge table cells if any found in Excel
-            if len(merged_ranges):
-                for merged_range in merged_ranges:
-                    start_cell = table.cell(
-                        merged_range.min_row-1,
-                        merged_range.min_col-1
-                    )
-                    end_cell = table.cell(
-                        merged_range.max_row-1,
-                        merged_range.max_col-1
-                    )
-                    start_cell.merge(end_cell)
-                    
+            for min_row, min_col, max_row, max_col in sheet.merges:
+                start_cell = table.cell(min_row-1, min_col-1)
+                end_cell = table.cell(max_row-1, max_col-1)
+                start_cell.merge(end_cell)
+
             # Write to table
             for r, row in enumerate(table.rows):
                 for c, cell in enumerate(row.cells):
-                    if len(table_values[r][c].plain_text()) > 0:
-                        table_values[r][c].add_to_paragraph(cell.paragraphs[0])
-                        
+                    if len(sheet.values[r][c].plain_text()) > 0:
+                        sheet.values[r][c].add_to_paragraph(cell.paragraphs[0], self.char_styles)
+
             # Style table
-            style_tbl(table, src_fmts)
+            style_tbl(table, sheet.formats, self.char_styles)
+
+        self.fragments[source] = (start, block_count(dest))
+
+    def append_chart(self, dest, source, heading=None, width=150, height=90, converted=None):
+        '''Appends every chart in the Excel source to the destination Word doc as an in-line image
+
+        Charts are re-drawn from their XML and series data, and cached so unchanged charts are not re-rendered.
+
+        Parameters
+        ----------
+        dest : DocxTemplate object
+            The destination word doc
+        source: str
+            The file location of the target Excel source
+        heading: str
+            A string that will be printed in the style of Heading 1 above the charts in word (default is None)
+        width, height: int
+            Size of each chart in mm
+        converted: list
+            Paths of the charts already rendered from source with render_charts() (default is None)
+        '''
+        start = block_count(dest)
+        if converted is not None:
+            im_paths = converted
+        else:
+            specs = read_charts(source)
+            im_paths = render_charts(specs, fmt='png', size=(width, height))
+
+        self.set_columns(dest, 1)  # Charts span the full page width
+
+        if heading:
+            dest.add_paragraph(style='Heading 1').add_run().add_text(heading)
 
-    def append_docx(self, dest, data, columns=1, new_page=False, separate_header=False):
+        for im_path in im_paths:
+            uid = f'chart_{sum(1 for key in self.context if key.startswith("chart_"))}'
+
+            img = dest.add_paragraph()
+            img.add_run().add_text("{{ " + uid + " }}")
+            img.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+            self.context[uid] = InlineImage(
+                dest,
+                im_path,
+                width=Mm(width),
+                height=Mm(height),
+            )
+
+        self.fragments[source] = (start, block_count(dest))
+
+    def append_docx(self, dest, data, columns=1, new_page=False, separate_header=False, converted=None):
         '''Appends content from the Word source to the destination Word doc - supports text and in-line images.
         DOES NOT SUPPORT FLOATING IMAGES AND SHAPES! Use add_docx() instead
-        
+
+        The source is streamed one paragraph at a time (see DocxStream), so memory use does not grow
+        with the length of the source document.
+
         Parameters
         ----------
         dest : str
             The file location of the destination word doc
         source: str
             The file location of the target Word source
+        converted: DocxStream or Document object
+            The Word source already opened, e.g. by the build planner (default is None, stream it from the file).
+            A DocxStream is streamed; a docx.Document() is read from its loaded tree
         '''
-        source = docx.Document(data)
-        ims = [im for im in source.inline_shapes]
+        start = block_count(dest)
+        source = converted if converted is not None else DocxStream(data)
+        if isinstance(source, DocxStream):
+            paras = source.paragraphs()
+            image = source.image
+        else:
+            paras = source.paragraphs
+            doc_part = source.part
 
-        # Persistent indexes
-        im_paths = []
-        im_heights = []
-        im_widths = []
+            def image(rId):
+                image_part = doc_part.related_parts[rId]
+                return image_part.blob, os.path.basename(image_part.partname)
 
-        # Temp variables
-        im_streams = []
-        
         # New page if true
         if new_page:
             dest.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
-        
-        # Get image binary and metadata
-        for im_idx, im in enumerate(ims):
-            # Binary
-            blip = im._inline.graphic.graphicData.pic.blipFill.blip
-            rId = blip.embed
-            doc_part = source.part
-            image_part = doc_part.related_parts[rId]
-            byte_data = image_part._blob
-            image_stream = io.BytesIO(byte_data)
-            im_streams.append(image_stream)
-
-            # Metadata
-            image_name = f'img_{im_idx}.jpeg'
-            im_heights.append(im.height.mm)
-            im_widths.append(im.width.mm)
-            
-            # Save images to temp folder
-            im_path = os.path.join(temp_path,image_name)
-            im_paths.append(im_path)
-            with open(im_path, "wb") as fh:
-                fh.write(byte_data)
-            fh.close()
-        # ----End image transfer----
-        # ----Start copying docx content----
-        # Populate and save output
-        paras = source.paragraphs
-        im_idx = 0
-        
+
         # Split into columns if header is not separate
         # Otherwise, split into columns after the header
         if not separate_header:
-            new_section_cols(dest, columns)
-        
+            self.set_columns(dest, columns)
+
         for para_idx, para in enumerate(paras):
             if(para.text):
-                get_para_data(dest, para)
-            
-            # Copy images over
-            root = ET.fromstring(para._p.xml)
-            namespace = {'wp':"http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"}
-            inlines = root.findall('.//wp:inline',namespace)
-
-            if(len(inlines) > 0):
-                uid = f'img_{im_idx}'
-
-                img = dest.add_paragraph()
-                img.add_run().add_text("{{ " + uid + " }}")
-                img.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-                context[uid] = InlineImage(
-                    dest,
-                    im_paths[im_idx],
-                    width=Mm(im_widths[im_idx]),
-                    height=Mm(im_heights[im_idx]),
-                )
-                im_idx += 1
-                
-                
+                get_para_data(dest, para, self.char_styles, self.footnotes)
+
+            # Copy images over, each in its own centred paragraph
+            for inline in para._p.iter(qn('wp:inline')):
+                blip = inline.find('.//' + qn('a:blip'))
+                extent = inline.find(qn('wp:extent'))
+                if blip is None or extent is None:
+                    continue
+                byte_data, name = image(blip.get(qn('r:embed')))
+                self.add_image(dest, byte_data, name, Emu(int(extent.get('cx'))), Emu(int(extent.get('cy'))))
+
             # Split into columns after the header
             if (para_idx == 0 and separate_header):
-                new_section_cols(dest, columns)
+                self.set_columns(dest, columns)
+
+        self.footnotes.flush()
+        self.fragments[data] = (start, block_count(dest))
+
+    def add_image(self, dest, byte_data, name, width, height):
+        '''Adds an image placeholder paragraph to the destination, rendered as an InlineImage when publishing
+
+        Image files and placeholder ids are numbered across the whole report, so images from
+        different sources never overwrite each other.
+        '''
+        uid = f'img_{sum(1 for key in self.context if key.startswith("img_"))}'
+        im_path = os.path.join(self.temp_path, f'{uid}_{name}')
+        with open(im_path, "wb") as fh:
+            fh.write(byte_data)
+
+        img = dest.add_paragraph()
+        img.add_run().add_text("{{ " + uid + " }}")
+        img.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+        self.context[uid] = InlineImage(dest, im_path, width=width, height=height)
+
+    def check_styles(self, template=None, sources=None):
+        '''Lints the assembled document for orphaned headings, tables without keep-with-next and font drift
+
+        Call it before publish() when passing sources: publishing removes merged section-break paragraphs
+        and re-renders the template, so the block ranges recorded for each source no longer line up.
+
+        Parameters
+        ----------
+        template : Document or DocxTemplate object
+            The template to compare fonts and sizes against (default is the destination's own styles)
+        sources : list
+            Only lint the content appended from these sources, e.g. the ones that changed (default is everything)
+
+        Returns
+        -------
+        issues : list of Issue(index, kind, message)
+        '''
+        if sources is not None and self.published:
+            raise ValueError('check_styles(sources=...) must run before publish(), the source ranges are stale')
+        ranges = None if sources is None else [self.fragments[source] for source in sources]
+        issues = check_styles(self.dest, template, ranges=ranges)
+        if issues:
+            print(format_issues(issues))
+        return issues
         
 
@@ -0,0 +1,134 @@
+# Standard imports
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Local imports
+from helpers.archive import preload
+
+# Blocking work from every report shares one bounded pool, so a burst of requests cannot spawn
+# unbounded threads. Each report is further limited to a few slots of it (see AsyncAssembler)
+MAX_WORKERS = 8
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='end-word')
+READ_AHEAD = 2  # Sections read ahead of the one being converted
+
+
+class AsyncAssembler:
+    '''Async facade over an Assembler, for use inside an event loop (e.g. a report web service)
+
+    Parsing, conversion and saving run on a bounded thread pool so the event loop is never blocked.
+    Appends to the destination document are serialised, while source files for later sections are
+    read ahead in parallel with the conversion of earlier ones.
+
+    If a call times out or is cancelled, the document being built is left part-way through and should
+    be discarded - the worker thread cannot be interrupted and may still finish its current step. Its
+    slot is only freed once that step ends, so abandoned reports never hold more than max_jobs threads.
+
+    Parameters
+    ----------
+    assembler : Assembler
+        The Assembler for this report. Each report needs its own
+    timeout : float
+        Default per-request timeout in seconds (default is None, no timeout)
+    max_jobs : int
+        Maximum pool slots this report may hold at once, so one slow report cannot take them all
+    executor : concurrent.futures.Executor
+        Pool to run blocking work on (default is the shared module pool)
+    '''
+    def __init__(self, assembler, timeout=None, max_jobs=2, executor=None):
+        self.assembler = assembler
+        self.timeout = timeout
+        self._executor = executor or _executor
+        self._jobs = asyncio.Semaphore(max_jobs)
+        self._dest_lock = asyncio.Lock()  # python-docx documents are not thread-safe
+
+    async def prefetch(self, source):
+        '''Read a source file into memory ahead of its conversion'''
+        await self._run(preload, source)
+
+    async def append_xlsx(self, dest, source, timeout=None, **kwargs):
+        await self._append(self.assembler.append_xlsx, dest, source, timeout, **kwargs)
+
+    async def append_chart(self, dest, source, timeout=None, **kwargs):
+        await self._append(self.assembler.append_chart, dest, source, timeout, **kwargs)
+
+    async def append_docx(self, dest, source, timeout=None, **kwargs):
+        await self._append(self.assembler.append_docx, dest, source, timeout, **kwargs)
+
+    async def publish(self, timeout=None):
+        async with self._dest_lock:
+            await self._with_timeout(self._run(self.assembler.publish), timeout)
+
+    async def assemble(self, dest, sections, publish=True, timeout=None):
+        '''Append every section in order, then publish
+
+        Source files are read up to READ_AHEAD sections ahead, so reading section n+1 overlaps with
+        converting section n. The timeout covers the whole report.
+
+        Parameters
+        ----------
+        dest : DocxTemplate object
+            The destination word doc
+        sections : list
+            (kind, source, kwargs) tuples, where kind is 'xlsx', 'chart' or 'docx'
+        publish : bool
+            Whether to publish once every section is appended (default is True)
+        timeout : float
+            Seconds allowed for the whole report (default is the instance timeout)
+        '''
+        await self._with_timeout(self._assemble(dest, sections, publish), timeout)
+
+    async def _assemble(self, dest, sections, publish):
+        appenders = {
+            'xlsx': self.assembler.append_xlsx,
+            'chart': self.assembler.append_chart,
+            'docx': self.assembler.append_docx,
+        }
+        # Read ahead a few sections at a time, so reads overlap conversion without crowding out appends
+        reads = {}
+
+        def read_ahead(index):
+            for ahead in range(index, min(index + READ_AHEAD + 1, len(sections))):
+                if ahead not in reads:
+                    reads[ahead] = asyncio.ensure_future(self.prefetch(sections[ahead][1]))
+
+        try:
+            for index, (kind, source, kwargs) in enumerate(sections):
+                read_ahead(index)
+                await reads[index]
+                async with self._dest_lock:
+                    await self._run(appenders[kind], dest, source, **(kwargs or {}))
+            if publish:
+                async with self._dest_lock:
+                    await self._run(self.assembler.publish)
+        finally:
+            # On error, timeout or cancellation, stop reading ahead for sections we will never reach
+            for read in reads.values():
+                read.cancel()
+
+    async def _append(self, append, dest, source, timeout, **kwargs):
+        async def run():
+            await self.prefetch(source)
+            async with self._dest_lock:
+                await self._run(append, dest, source, **kwargs)
+        await self._with_timeout(run(), timeout)
+
+    async def _run(self, func, *args, **kwargs):
+        # The slot is released when the worker finishes, not when the caller stops waiting on it
+        await self._jobs.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._jobs.release()
+            raise
+
+        def release(_):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._jobs.release)
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    async def _with_timeout(self, coro, timeout):
+        timeout = self.timeout if timeout is None else timeout
+        return await asyncio.wait_for(coro, timeout)
@@ -0,0 +1,427 @@
+'''Benchmark runner and performance regression gate
+
+Times the Assembler steps over a folder of sample content (test/samples by default), records the
+results in a local history file keyed by git commit, and compares them against a stored baseline.
+Exits with status 1 when a benchmark got slower or hungrier than the allowed threshold.
+
+    python benchmark.py                      # Run, compare with the latest other commit, record
+    python benchmark.py --baseline HEAD~3    # Compare with a specific commit
+    python benchmark.py --threshold 0.1 --no-save
+
+Peak memory is recorded two ways: tracemalloc's high-water mark, which only sees allocations made through
+Python, and how far running the benchmark once raises the peak resident set size of a fresh process, which
+also includes lxml's C allocations (ru_maxrss, where the resource module is available).
+'''
+# Standard imports
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+# Third-party imports
+from lxml import etree
+from docx.enum.text import WD_BREAK
+from docx.shared import Pt
+from docxtpl import DocxTemplate
+
+# Local imports
+from assembler import Assembler
+from helpers.archive import close_all
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLES = os.path.join(HERE, os.pardir, 'test', 'samples')
+HISTORY = os.path.join(HERE, '.benchmarks', 'history.json')
+
+REPEAT = 5
+WARMUP = 1
+THRESHOLD = 0.25  # Allowed slow-down of the median time, as a fraction
+MEMORY_THRESHOLD = 0.25  # Allowed growth of peak memory, as a fraction
+NOISE = 3.0  # A slow-down must also exceed this many robust standard deviations to count
+MIN_DELTA = 0.002  # Seconds - differences smaller than this are timer and scheduler noise
+MIN_RSS_DELTA = 2 ** 20  # Bytes - peak RSS moves in pages and allocator arenas, smaller growth is noise
+CALIBRATION_SIZE = 20000  # Elements in the calibration workload
+MAD_TO_SD = 1.4826  # Scales the median absolute deviation to a standard deviation for normal noise
+
+CONTEXT = {
+    'title': 'Benchmark',
+    'subtitle': 'end-word',
+    'date': datetime.date.today(),
+    'closing': 'THANK YOU',
+    'copyright': '',
+    'website': '',
+    'email': '',
+    'number': '',
+}
+
+
+class Scenario:
+    '''
+    The report built from a samples folder: title page, content files (sorted by name) and backpage.
+    Content is picked by file name the same way control.ipynb does.
+    '''
+    def __init__(self, samples=SAMPLES):
+        self.samples = os.path.abspath(samples)
+        names = sorted(os.listdir(self.samples))
+        self.template = os.path.join(self.samples, next(name for name in names if 'template' in name))
+        self.backpage = os.path.join(self.samples, next(name for name in names if 'backpage' in name))
+        self.contents = [os.path.join(self.samples, name) for name in names if 'content' in name]
+        self.output_dir = tempfile.mkdtemp()
+        self._temp_paths = [self.output_dir]
+
+    def new_assembler(self):
+        # Start cold - nothing left in the shared archive cache from the previous run
+        close_all()
+        dest = DocxTemplate(self.template)
+        dest.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+        output_path = os.path.join(self.output_dir, 'output.docx')
+        assembler = Assembler(dest, CONTEXT, self.backpage, output_path)
+        self._temp_paths.append(assembler.temp_path)
+        return assembler, dest
+
+    def cleanup(self):
+        '''
+        Remove the output and image temp folders of every assembler created
+        '''
+        for path in self._temp_paths:
+            shutil.rmtree(path, ignore_errors=True)
+        self._temp_paths = []
+
+    def append(self, assembler, dest, content):
+        name = os.path.basename(content)
+        if name.endswith('.xlsx'):
+            if 'tbl' in name:
+                assembler.append_xlsx(dest, content)
+            elif 'chart' in name:
+                assembler.append_chart(dest, content)
+            dest.add_paragraph().paragraph_format.space_after = Pt(20)
+        elif name.endswith('.docx'):
+            cols = name[:-5].split('_')[-1]
+            assembler.append_docx(dest, content, columns=cols, separate_header=True)
+
+    def benchmarks(self):
+        '''
+        (name, setup, run) for every benchmark. setup() returns the arguments run() is timed with
+        '''
+        benches = []
+        for content in self.contents:
+            name = os.path.basename(content)
+            if name.endswith('.xlsx'):
+                kind = 'append_xlsx' if 'tbl' in name else 'append_chart'
+            elif name.endswith('.docx'):
+                kind = 'append_docx'
+            else:
+                continue
+            benches.append((
+                f'{kind}[{name}]',
+                lambda: self.new_assembler(),
+                lambda assembler, dest, content=content: self.append(assembler, dest, content),
+            ))
+
+        def assembled():
+            assembler, dest = self.new_assembler()
+            for content in self.contents:
+                self.append(assembler, dest, content)
+            return (assembler,)
+
+        def build(assembler, dest):
+            for content in self.contents:
+                self.append(assembler, dest, content)
+            assembler.publish()
+
+        benches.append(('publish', assembled, lambda assembler: assembler.publish()))
+        benches.append(('build', lambda: self.new_assembler(), build))
+        return benches
+
+
+def calibrate():
+    '''
+    A fixed workload of building and serialising XML, timed alongside the benchmarks. Its time tells
+    how fast the machine is running right now, so runs on a busy or throttled machine can be compared
+    with a baseline recorded on a quiet one.
+    '''
+    root = etree.Element('root')
+    for i in range(CALIBRATION_SIZE):
+        etree.SubElement(root, 'r', val=str(i)).text = 'x' * (i % 17)
+    return len(etree.tostring(root))
+
+
+def measure(benchmarks, repeat=REPEAT, warmup=WARMUP):
+    '''Times run(*setup()) for every benchmark, then measures each one's peak memory in a traced run
+
+    Repeats are taken in rounds - every benchmark and the calibration workload once per round - so a
+    slow patch on the machine hits all of them alike instead of one benchmark's whole sample. Setup is
+    not timed. Memory is traced separately because tracemalloc slows everything down.
+
+    Returns
+    -------
+    results : dict
+        name -> times (seconds, one per repeat) and peak (bytes allocated at the high-water mark)
+    calibration : list
+        Seconds the calibration workload took in each round
+    '''
+    results = {name: {'times': [], 'peak': 0} for name, _, _ in benchmarks}
+    calibration = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(warmup + repeat):
+            start = time.perf_counter()
+            calibrate()
+            if i >= warmup:
+                calibration.append(time.perf_counter() - start)
+            for name, setup, run in benchmarks:
+                args = setup()
+                start = time.perf_counter()
+                run(*args)
+                elapsed = time.perf_counter() - start
+                if i >= warmup:
+                    results[name]['times'].append(elapsed)
+
+        for name, setup, run in benchmarks:
+            args = setup()
+            tracemalloc.start()
+            try:
+                run(*args)
+                _, results[name]['peak'] = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+    return results, calibration
+
+
+def peak_rss(name, samples=SAMPLES):
+    '''
+    Bytes by which running one benchmark raises the peak resident set size of a fresh interpreter, over
+    what imports and setup already reached, or None where it cannot be measured. Worker processes started
+    by the benchmark are not included.
+    '''
+    if resource is None:
+        return None
+    try:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--samples', samples, '--rss-of', name],
+                                cwd=HERE, check=True, capture_output=True, text=True).stdout
+    except subprocess.CalledProcessError as e:
+        print(f'Could not measure the peak RSS of {name}: {e.stderr.strip().splitlines()[-1:]}')
+        return None
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _run_for_rss(name, samples):
+    scenario = Scenario(samples)
+    try:
+        setup, run = next((setup, run) for bench, setup, run in scenario.benchmarks() if bench == name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            args = setup()
+            before = _high_water_rss()
+            run(*args)
+            after = _high_water_rss()
+    finally:
+        scenario.cleanup()
+    print(json.dumps(after - before))
+
+
+def _high_water_rss():
+    '''
+    Peak resident set size of this process so far, in bytes. Linux carries the parent's ru_maxrss over
+    fork and exec, so its per-process VmHWM is read instead where /proc is available
+    '''
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def summarise(result):
+    times = result['times']
+    median = statistics.median(times)
+    mad = statistics.median(abs(t - median) for t in times)
+    return median, mad
+
+
+def compare(current, baseline, threshold=THRESHOLD, memory_threshold=MEMORY_THRESHOLD, noise=NOISE, speed=1.0):
+    '''Compares each benchmark's median time and peak memory against the baseline
+
+    A benchmark only regresses on time when both its median and its fastest run are more than
+    threshold slower, and the difference is larger than MIN_DELTA and than noise robust standard
+    deviations (from the median absolute deviation of either run). Baseline times are first scaled
+    by speed, how much slower the machine ran the calibration workload than when the baseline was
+    recorded, so a busy or throttled machine does not fail the gate on its own.
+
+    Peak memory is compared twice, the tracemalloc peak and the peak RSS, and either can regress.
+
+    Returns
+    -------
+    rows : list of dict
+        name, time/memory change and whether it regressed, one per current benchmark
+    '''
+    rows = []
+    for name, result in current.items():
+        median, mad = summarise(result)
+        row = {'name': name, 'median': median, 'peak': result['peak'], 'rss': result.get('rss'),
+               'time_change': None, 'memory_change': None, 'rss_change': None, 'regressed': []}
+        base = baseline.get(name)
+        if base is not None:
+            base_times = [t * speed for t in base['times']]
+            base_median, base_mad = summarise({'times': base_times})
+            row['time_change'] = median / base_median - 1 if base_median else 0.0
+            best_change = min(result['times']) / min(base_times) - 1 if min(base_times) else 0.0
+            spread = max(noise * MAD_TO_SD * max(mad, base_mad), MIN_DELTA)
+            if min(row['time_change'], best_change) > threshold and median - base_median > spread:
+                row['regressed'].append('time')
+            if base['peak']:
+                row['memory_change'] = result['peak'] / base['peak'] - 1
+                if row['memory_change'] > memory_threshold:
+                    row['regressed'].append('memory')
+            if base.get('rss') and row['rss']:
+                row['rss_change'] = row['rss'] / base['rss'] - 1
+                if row['rss_change'] > memory_threshold and row['rss'] - base['rss'] > MIN_RSS_DELTA:
+                    row['regressed'].append('rss')
+        rows.append(row)
+    return rows
+
+
+def format_rows(rows):
+    lines = [f"{'benchmark':<48} {'median':>10} {'change':>8} {'peak':>10} {'change':>8} {'rss':>10} {'change':>8}"]
+    for row in rows:
+        time_change = f"{row['time_change']:+.1%}" if row['time_change'] is not None else 'new'
+        memory_change = f"{row['memory_change']:+.1%}" if row['memory_change'] is not None else 'new'
+        rss_change = f"{row['rss_change']:+.1%}" if row['rss_change'] is not None else 'new'
+        rss = f"{row['rss'] / 2 ** 20:>8.1f}MB" if row['rss'] else f"{'-':>10}"
+        flag = f"  REGRESSED ({', '.join(row['regressed'])})" if row['regressed'] else ''
+        lines.append(f"{row['name']:<48} {row['median'] * 1000:>8.1f}ms {time_change:>8} "
+                     f"{row['peak'] / 1024:>8.0f}kB {memory_change:>8} {rss} {rss_change:>8}{flag}")
+    return '\n'.join(lines)
+
+
+def git_commit(ref='HEAD'):
+    '''
+    Full commit hash for ref, or None outside a git checkout
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--verify', f'{ref}^{{commit}}'], cwd=HERE, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def git_dirty():
+    try:
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=HERE, check=True,
+                                capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return bool(status.strip())
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def save_history(path, history):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(history, fh, indent=1)
+    os.replace(tmp, path)
+
+
+def pick_baseline(history, key, ref=None):
+    '''
+    The history entry to compare against: the commit ref names, otherwise the most recent recorded
+    commit other than the current one. Runs from a dirty working tree are never picked by default.
+    '''
+    if ref is not None:
+        commit = git_commit(ref) or ref
+        return commit, history.get(commit)
+    candidates = [(entry['timestamp'], commit) for commit, entry in history.items()
+                  if commit != key and not entry.get('dirty')]
+    if not candidates:
+        return None, None
+    _, commit = max(candidates)
+    return commit, history[commit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', default=SAMPLES, help='Folder with the template, content and backpage files')
+    parser.add_argument('--history', default=HISTORY, help='History file (default .benchmarks/history.json)')
+    parser.add_argument('--baseline', help='Commit to compare against (default is the latest other recorded commit)')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='Timed runs per benchmark')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='Allowed slow-down, e.g. 0.25 for 25%%')
+    parser.add_argument('--memory-threshold', type=float, default=MEMORY_THRESHOLD, help='Allowed peak memory growth')
+    parser.add_argument('--only', help='Only run benchmarks whose name contains this text')
+    parser.add_argument('--no-save', action='store_true', help='Do not record this run in the history')
+    parser.add_argument('--no-rss', action='store_true', help='Skip the peak RSS runs, one process per benchmark')
+    parser.add_argument('--rss-of', help=argparse.SUPPRESS)  # Child process of peak_rss()
+    args = parser.parse_args(argv)
+
+    if args.rss_of:
+        _run_for_rss(args.rss_of, args.samples)
+        return 0
+
+    scenario = Scenario(args.samples)
+    benchmarks = [bench for bench in scenario.benchmarks() if not args.only or args.only in bench[0]]
+    try:
+        current, calibration = measure(benchmarks, repeat=args.repeat)
+    finally:
+        scenario.cleanup()
+    for name, _, _ in benchmarks:
+        current[name]['rss'] = None if args.no_rss else peak_rss(name, args.samples)
+
+    history = load_history(args.history)
+    commit = git_commit() or 'unknown'
+    dirty = git_dirty()
+    key = f'{commit}-dirty' if dirty else commit
+
+    baseline_commit, baseline = pick_baseline(history, key, args.baseline)
+    speed = 1.0
+    if baseline is not None and baseline.get('calibration'):
+        speed = statistics.median(calibration) / statistics.median(baseline['calibration'])
+    rows = compare(current, baseline['results'] if baseline else {}, args.threshold, args.memory_threshold, speed=speed)
+    print(format_rows(rows))
+    if baseline is None:
+        print(f"No baseline{f' for {args.baseline}' if args.baseline else ''} in {args.history}, nothing to compare against")
+    else:
+        print(f'Compared against {baseline_commit[:12]} (recorded {baseline["timestamp"]}), '
+              f'machine speed {1 / speed:.2f}x the baseline run')
+
+    if not args.no_save:
+        history[key] = {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'dirty': dirty,
+            'python': sys.version.split()[0],
+            'calibration': calibration,
+            'results': current,
+        }
+        save_history(args.history, history)
+        print(f'Recorded as {key[:12]}{" (dirty)" if dirty else ""} in {args.history}')
+
+    regressed = [row['name'] for row in rows if row['regressed']]
+    if regressed:
+        print(f"{len(regressed)} benchmark(s) regressed beyond the threshold: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,279 @@
+# Shared access to .docx/.xlsx packages
+# Every Office file is a zip archive, and the same file is often opened several times per build
+# (openpyxl, the custom Excel parser, python-docx, docxtpl). Packages are opened once, memory-mapped,
+# and decompressed parts are kept in a bounded LRU cache that all readers share.
+import io
+import mmap
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+CACHE_BYTES = 64 * 1024 * 1024  # Budget for decompressed parts
+MAX_OPEN = 32  # Packages kept open at once
+POOL_PRELOAD = ['helpers.sheets', 'helpers.chart']  # Imported once by the fork server, not by every worker
+
+
+class PartCache:
+    '''
+    LRU cache of decompressed parts keyed by (file identity, mtime, part name), bounded by total bytes
+    '''
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.bytes_inflated = 0  # Bytes we had to decompress
+        self.bytes_served = 0  # Bytes handed out straight from the cache
+        self.hits = 0
+        self.misses = 0
+        self._parts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, inflate):
+        '''
+        Return the part for key, calling inflate() to decompress it on a miss
+        '''
+        with self._lock:
+            data = self._parts.get(key)
+            if data is not None:
+                self._parts.move_to_end(key)
+                self.hits += 1
+                self.bytes_served += len(data)
+                return data
+
+        data = inflate()
+        with self._lock:
+            self.misses += 1
+            self.bytes_inflated += len(data)
+            if len(data) <= self.max_bytes and key not in self._parts:
+                self._parts[key] = data
+                self.size += len(data)
+                while self.size > self.max_bytes:
+                    _, evicted = self._parts.popitem(last=False)
+                    self.size -= len(evicted)
+        return data
+
+    def stats(self):
+        return {
+            'bytes_inflated': self.bytes_inflated,
+            'bytes_served': self.bytes_served,
+            'hits': self.hits,
+            'misses': self.misses,
+            'cached_bytes': self.size,
+            'cached_parts': len(self._parts),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._parts.clear()
+            self.size = 0
+
+
+class Package:
+    '''
+    A single opened package. Parts are read through the shared PartCache. stream() gives independent
+    file-like views of the whole archive for libraries that want to open the zip themselves.
+    '''
+    def __init__(self, source, cache=None):
+        self.cache = cache
+        self._lock = threading.Lock()
+        if isinstance(source, (str, os.PathLike)):
+            self.path = os.path.realpath(source)
+            stat = os.stat(self.path)
+            self.key = (self.path, stat.st_mtime_ns, stat.st_size)
+            with open(self.path, 'rb') as fh:
+                self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # File-like objects have no stable identity, so their parts are not cached
+            self.path = None
+            self.key = None
+            self._map = source.read()
+        self._zip = zipfile.ZipFile(self.stream())
+
+    def namelist(self):
+        return self._zip.namelist()
+
+    def read(self, part):
+        '''
+        Return the decompressed bytes of a part, e.g. 'xl/styles.xml'
+        '''
+        if self.cache is None or self.key is None:
+            return self._inflate(part)
+        return self.cache.get(self.key + (part,), lambda: self._inflate(part))
+
+    def open(self, part):
+        '''
+        File-like access to a part, matching zipfile.ZipFile.open()
+        '''
+        return io.BytesIO(self.read(part))
+
+    def stream_part(self, part):
+        '''
+        A reader that decompresses a part as it is read, without caching it - for parts too large to
+        hold in memory at once, such as the document.xml of a very long report
+        '''
+        return self._zip.open(part)
+
+    def stream(self):
+        '''
+        A new seekable reader over the whole archive (docx.Document, DocxTemplate, load_workbook, ...)
+        '''
+        if isinstance(self._map, bytes):
+            return io.BytesIO(self._map)
+        return io.BufferedReader(_MappedReader(self._map))
+
+    def preload(self, parts=None):
+        '''
+        Pull the package into memory ahead of use. Named parts are inflated into the part cache;
+        with no parts, every page of the file is touched so later stream() readers never block on disk.
+        '''
+        if parts is not None:
+            for part in parts:
+                self.read(part)
+            return
+        if isinstance(self._map, mmap.mmap):
+            page = mmap.PAGESIZE
+            for offset in range(0, len(self._map), page):
+                self._map[offset]
+
+    def close(self):
+        self._zip.close()
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+    def _inflate(self, part):
+        with self._lock:
+            return self._zip.read(part)
+
+
+class _MappedReader(io.RawIOBase):
+    '''
+    Read-only file object over a memory map with its own position, so several readers can share one map
+    '''
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        end = min(self._pos + len(buffer), len(self._data))
+        size = max(end - self._pos, 0)  # Nothing to read once seeked past the end
+        buffer[:size] = self._data[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._data)
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+part_cache = PartCache()
+_packages = OrderedDict()
+_packages_lock = threading.Lock()
+
+
+def open_package(source):
+    '''
+    Returns the shared Package for a file path, opening it on first use. A file that changed on disk
+    (new mtime or size) is opened again. File-like sources get a private, uncached Package.
+    '''
+    if not isinstance(source, (str, os.PathLike)):
+        return Package(source)
+
+    path = os.path.realpath(source)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _packages_lock:
+        package = _packages.get(key)
+        if package is not None:
+            _packages.move_to_end(key)
+            return package
+        package = Package(path, part_cache)
+        _packages[key] = package
+        while len(_packages) > MAX_OPEN:
+            # Not closed here - another thread may still be reading it. The map is released with
+            # the last reference to the package
+            _packages.popitem(last=False)
+    return package
+
+
+def release(*sources):
+    '''
+    Stop keeping the packages of these files open, e.g. once the build that read them is done.
+    Mapped files cannot be saved over on Windows (and may crash readers if rewritten in place on
+    POSIX), so they should not stay mapped for the life of the process.
+
+    Packages are dropped rather than closed, so a concurrent build still reading the same file
+    (a shared backpage, say) is not cut off; each file is unmapped as soon as its last reader is
+    done, and opened again if it is used later. File-like sources are ignored.
+    '''
+    paths = {os.path.realpath(source) for source in sources if isinstance(source, (str, os.PathLike))}
+    with _packages_lock:
+        for key in [key for key in _packages if key[0] in paths]:
+            del _packages[key]
+
+
+def preload(source):
+    '''
+    Read a source file into memory ahead of its conversion. For .xlsx files the XML parts the custom
+    Excel parser reads are inflated into the shared cache; other packages have their pages touched.
+    '''
+    package = open_package(source)
+    if str(source).endswith('.xlsx'):
+        package.preload([name for name in package.namelist() if name.startswith('xl/') and name.endswith('.xml')])
+    else:
+        package.preload()
+    return package
+
+
+def cache_stats():
+    '''
+    Counters for the shared part cache - bytes inflated versus bytes served from the cache
+    '''
+    return part_cache.stats()
+
+
+def close_all():
+    '''
+    Close every open package and empty the part cache
+    '''
+    with _packages_lock:
+        while _packages:
+            _, package = _packages.popitem()
+            package.close()
+    part_cache.clear()
+
+
+def process_pool(max_workers=None):
+    '''
+    A process pool whose workers are not forked from this process.
+
+    Conversions start pools from converter threads (planner, AsyncAssembler) while reader threads may
+    be holding the package locks above. A forked child inherits those locks held, and blocks forever
+    on its first open_package(). Workers are started by a fork server instead - a clean process with the
+    conversion helpers already imported, so starting a worker stays cheap - or spawned where there is
+    no fork server (Windows).
+
+    As with any non-fork pool, workers re-import the main script: a script that converts workbooks
+    with several sheets, or several charts, must run its build under `if __name__ == '__main__':`.
+    Notebooks need nothing.
+    '''
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(POOL_PRELOAD)
+    else:
+        context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
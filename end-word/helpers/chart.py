@@ -0,0 +1,324 @@
+# Excel charts -> images
+# openpyxl cannot read charts back out of a workbook, so the chart parts are parsed directly
+# and re-drawn with matplotlib. Rendered images are cached on disk by a hash of the chart XML
+# and its data, so unchanged charts are never rendered twice.
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+import xml.etree.ElementTree as ET
+
+import matplotlib
+matplotlib.use('Agg')  # Headless backend, no display required
+import matplotlib.pyplot as plt
+
+from helpers.archive import open_package, process_pool
+from helpers.excel import custom_load_workbook
+
+C = '{http://schemas.openxmlformats.org/drawingml/2006/chart}'
+A = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+
+CHART_PART = re.compile(r'xl/charts/chart(\d+)\.xml$')
+CHART_TYPES = {
+    'barChart': 'bar', 'bar3DChart': 'bar',
+    'lineChart': 'line', 'line3DChart': 'line',
+    'areaChart': 'area', 'area3DChart': 'area',
+    'pieChart': 'pie', 'pie3DChart': 'pie', 'doughnutChart': 'doughnut',
+    'scatterChart': 'scatter',
+}
+CACHE_PATH = os.path.join(tempfile.gettempdir(), 'end-word-charts')
+
+
+def read_charts(source):
+    '''
+    Reads every chart in an Excel workbook and returns a list of chart specs (dicts), in part order.
+
+    Series names and data come from the cached values stored with the chart. If a series has no cache
+    (openpyxl writes none), its reference (e.g. 'Sheet1'!$B$2:$B$5) is resolved against the workbook's
+    cell values instead.
+    '''
+    container = open_package(source)
+    parts = sorted(
+        (int(match.group(1)), name)
+        for name in container.namelist()
+        for match in [CHART_PART.match(name)] if match
+    )
+
+    wb = None
+    charts = []
+    for _, name in parts:
+        xml = container.read(name)
+        root = ET.fromstring(xml)
+        chart = root.find(C + 'chart')
+        spec = {
+            'name': name,
+            'title': _title(chart),
+            'groups': [],
+            'xml': xml,
+        }
+        plot_area = chart.find(C + 'plotArea')
+        for group in plot_area:
+            tag = group.tag[len(C):]
+            if tag not in CHART_TYPES:
+                continue
+            group_spec = {
+                'type': CHART_TYPES[tag],
+                'bar_dir': _val(group.find(C + 'barDir'), 'col'),
+                'grouping': _val(group.find(C + 'grouping'), 'clustered'),
+                'series': [],
+            }
+            for ser in group.findall(C + 'ser'):
+                cat = ser.find(C + 'cat')
+                if cat is None:
+                    cat = ser.find(C + 'xVal')
+                val = ser.find(C + 'val')
+                if val is None:
+                    val = ser.find(C + 'yVal')
+
+                series = {
+                    'name': _series_name(ser),
+                    'categories': _data(cat),
+                    'values': _data(val),
+                    'color': _color(ser.find(C + 'spPr')),
+                }
+                # Fall back to the worksheet when the chart has no cached values
+                for key, node in (('name', ser.find(C + 'tx')), ('categories', cat), ('values', val)):
+                    if series[key] is None and node is not None:
+                        ref = node.find('.//' + C + 'f')
+                        if ref is not None:
+                            wb = wb or custom_load_workbook(source)
+                            series[key] = _resolve_ref(wb, ref.text)
+                if isinstance(series['name'], list):
+                    # A name spanning several cells is shown space-separated, as Excel does
+                    series['name'] = ' '.join(v for v in series['name'] if v) or None
+                if series['values'] is not None:
+                    series['values'] = [_to_float(v) for v in series['values']]
+                group_spec['series'].append(series)
+            spec['groups'].append(group_spec)
+        charts.append(spec)
+    return charts
+
+
+def chart_key(spec, fmt='png', size=(150, 90)):
+    '''
+    Cache key for a chart - a hash of the chart XML plus the resolved names, data and output settings
+    '''
+    digest = hashlib.sha256(spec['xml'])
+    data = [[s['name'], s['categories'], s['values']] for group in spec['groups'] for s in group['series']]
+    digest.update(json.dumps([data, fmt, list(size)], default=str).encode())
+    return digest.hexdigest()
+
+
+def render_charts(specs, fmt='png', size=(150, 90), cache_path=CACHE_PATH, max_workers=None):
+    '''
+    Renders chart specs to image files and returns their paths, in the same order as specs.
+
+    Charts already in the cache are not re-rendered. The rest are rendered in parallel across
+    processes (matplotlib is not thread-safe).
+
+    Parameters
+    ----------
+    specs : list
+        Chart specs from read_charts()
+    fmt : str
+        Image format, 'png' or 'svg'. Word documents need png
+    size : tuple
+        Width and height of each image in mm
+    cache_path : str
+        Folder holding rendered charts
+    max_workers : int
+        Size of the render pool (default is the number of CPUs)
+    '''
+    os.makedirs(cache_path, exist_ok=True)
+    paths = []
+    pending = []
+    for spec in specs:
+        path = os.path.join(cache_path, f'{chart_key(spec, fmt, size)}.{fmt}')
+        paths.append(path)
+        if not os.path.exists(path) and path not in [p for _, p in pending]:
+            pending.append((spec, path))
+
+    if len(pending) == 1:
+        render_chart(pending[0][0], pending[0][1], size)
+    elif pending:
+        with process_pool(max_workers=max_workers) as pool:
+            jobs = [pool.submit(render_chart, spec, path, size) for spec, path in pending]
+            for job in jobs:
+                job.result()
+    return paths
+
+
+def render_chart(spec, path, size=(150, 90)):
+    '''
+    Draws a single chart spec with matplotlib and saves it to path. The format follows the extension
+    '''
+    mm_per_inch = 25.4
+    fig, ax = plt.subplots(figsize=(size[0] / mm_per_inch, size[1] / mm_per_inch))
+    try:
+        for group in spec['groups']:
+            _plot_group(ax, group)
+        if spec['title']:
+            ax.set_title(spec['title'])
+        names = [s['name'] for group in spec['groups'] for s in group['series'] if s['name']]
+        if names and not any(group['type'] in ('pie', 'doughnut') for group in spec['groups']):
+            ax.legend(frameon=False)
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        fig.tight_layout()
+        # Write to a temp name first so a half-written file is never picked up by the cache
+        tmp_path = f'{path}.{os.getpid()}.tmp{os.path.splitext(path)[1]}'
+        fig.savefig(tmp_path, dpi=200)
+        os.replace(tmp_path, path)
+    finally:
+        plt.close(fig)
+    return path
+
+
+def _plot_group(ax, group):
+    # Gaps in the data are NaN, which matplotlib leaves out of lines, areas and bars - like Excel's
+    # default of showing empty cells as gaps. Series may be shorter than the category axis
+    series = [s for s in group['series'] if s['values']]
+    if not series:
+        return
+    chart_type = group['type']
+    count = max(len(s['values']) for s in series)
+    categories = ['' if c is None else str(c) for c in (series[0]['categories'] or [])]
+    categories += [str(i + 1) for i in range(len(categories), count)]
+    positions = range(len(categories))
+
+    if chart_type in ('pie', 'doughnut'):
+        s = series[0]
+        wedges = [(label, v) for label, v in zip(categories, s['values']) if not math.isnan(v)]
+        wedge = {'width': 0.4} if chart_type == 'doughnut' else None
+        ax.pie([v for _, v in wedges], labels=[label for label, _ in wedges], wedgeprops=wedge,
+               startangle=90, counterclock=False)
+        ax.axis('equal')
+        return
+
+    if chart_type == 'scatter':
+        for s in series:
+            xs = [_to_float(x) for x in s['categories']] if s['categories'] else list(positions)
+            points = list(zip(xs, s['values']))
+            ax.scatter([x for x, _ in points], [y for _, y in points], label=s['name'], color=s['color'])
+        return
+
+    if chart_type == 'bar':
+        stacked = group['grouping'] in ('stacked', 'percentStacked')
+        # Pad every series to the category count, so stacks line up
+        values = [s['values'] + [math.nan] * (len(categories) - len(s['values'])) for s in series]
+        if group['grouping'] == 'percentStacked':
+            totals = [sum(abs(v[i]) for v in values if not math.isnan(v[i])) or 1 for i in positions]
+            values = [[v[i] / totals[i] * 100 for i in positions] for v in values]
+        width = 0.8 if stacked else 0.8 / len(series)
+        bottoms = [0] * len(categories)
+        draw = ax.barh if group['bar_dir'] == 'bar' else ax.bar
+        for n, (s, vals) in enumerate(zip(series, values)):
+            offsets = positions if stacked else [p - 0.4 + width * (n + 0.5) for p in positions]
+            base = {'left': bottoms} if group['bar_dir'] == 'bar' else {'bottom': bottoms}
+            draw(offsets, vals, width, label=s['name'], color=s['color'], **(base if stacked else {}))
+            if stacked:
+                bottoms = [b if math.isnan(v) else b + v for b, v in zip(bottoms, vals)]
+        if group['bar_dir'] == 'bar':
+            ax.set_yticks(list(positions))
+            ax.set_yticklabels(categories)
+            ax.invert_yaxis()  # Excel draws the first category at the top
+        else:
+            ax.set_xticks(list(positions))
+            ax.set_xticklabels(categories)
+        return
+
+    for s in series:
+        own = range(len(s['values']))
+        if chart_type == 'area':
+            ax.fill_between(own, s['values'], label=s['name'], color=s['color'], alpha=0.8)
+        else:
+            ax.plot(own, s['values'], label=s['name'], color=s['color'])
+    ax.set_xticks(list(positions))
+    ax.set_xticklabels(categories)
+
+
+def _title(chart):
+    if chart is None:
+        return None
+    deleted = chart.find(C + 'autoTitleDeleted')
+    title = chart.find(C + 'title')
+    if title is None:
+        return None
+    text = ''.join(t.text or '' for t in title.iter(A + 't'))
+    if not text:
+        cached = title.find('.//' + C + 'v')
+        text = cached.text if cached is not None else ''
+    if not text and _val(deleted, '0') in ('1', 'true'):
+        return None
+    return text or None
+
+
+def _series_name(ser):
+    tx = ser.find(C + 'tx')
+    if tx is None:
+        return None
+    value = tx.find('.//' + C + 'v')
+    return value.text if value is not None else None
+
+
+def _data(node):
+    '''
+    Read cached points from a c:cat/c:val (or xVal/yVal) node. Returns None when no cache is stored
+    '''
+    if node is None:
+        return None
+    cache = node.find('.//' + C + 'numCache')
+    if cache is None:
+        cache = node.find('.//' + C + 'strCache')
+    if cache is None:
+        cache = node.find('.//' + C + 'numLit')
+    if cache is None:
+        return None
+    count = int(_val(cache.find(C + 'ptCount'), '0'))
+    points = [None] * count
+    for pt in cache.findall(C + 'pt'):
+        idx = int(pt.attrib['idx'])
+        if idx >= len(points):
+            points.extend([None] * (idx + 1 - len(points)))
+        points[idx] = pt.find(C + 'v').text
+    return points
+
+
+def _resolve_ref(wb, ref):
+    '''
+    Look up an A1 range reference such as 'Sheet 1'!$B$2:$B$5 in a custom_load_workbook Workbook
+    '''
+    sheet_name, _, rng = ref.rpartition('!')
+    sheet_name = sheet_name.strip("'").replace("''", "'")
+    ws = wb.sheets.get(sheet_name, wb.active)
+    cells = ws.get_range(rng.replace('$', ''))
+    if cells and isinstance(cells[0], list):
+        cells = [cell for row in cells for cell in row]
+    return [cell.value.plain_text() for cell in cells]
+
+
+def _color(sp_pr):
+    if sp_pr is None:
+        return None
+    rgb = sp_pr.find(A + 'solidFill/' + A + 'srgbClr')
+    if rgb is None:
+        rgb = sp_pr.find(A + 'ln/' + A + 'solidFill/' + A + 'srgbClr')
+    return f"#{rgb.attrib['val']}" if rgb is not None else None
+
+
+def _val(node, default=None):
+    return node.attrib.get('val', default) if node is not None else default
+
+
+def _to_float(value):
+    '''
+    A cached point as a number. Missing points (None) and text become NaN, so they are drawn as gaps
+    '''
+    if value is None:
+        return math.nan
+    try:
+        return float(str(value).replace(',', '').rstrip('%'))
+    except ValueError:
+        return math.nan
@@ -0,0 +1,229 @@
+from lxml import etree
+from docx.oxml.ns import qn  # For defining and targeting xml elements to change
+
+# Run compaction - a clean-up pass before saving
+# Copying content run by run leaves long chains of identically formatted runs, plus rPr entries that
+# only repeat what the paragraph style already says. Merging the runs and dropping those entries gives
+# a smaller document.xml, which renders, saves and opens faster.
+
+R = qn('w:r')
+R_PR = qn('w:rPr')
+T = qn('w:t')
+VAL = qn('w:val')
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+# Run content that can be safely concatenated into a neighbouring run. Anything else (field characters,
+# instrText, footnote/endnote/comment references, drawings, objects) keeps its run as it is
+MERGEABLE = {qn('w:t'), qn('w:tab'), qn('w:br'), qn('w:cr'), qn('w:noBreakHyphen'), qn('w:softHyphen')}
+
+# On/off properties that flip relative to their basedOn style instead of overriding it
+TOGGLES = {qn(f'w:{tag}') for tag in (
+    'b', 'bCs', 'i', 'iCs', 'caps', 'smallCaps', 'strike', 'dstrike', 'outline', 'shadow', 'emboss', 'imprint', 'vanish'
+)}
+# rPr children that are never stripped
+KEEP = {qn('w:rStyle'), qn('w:rPrChange'), qn('w:ins'), qn('w:del')}
+
+
+class _StyleRunProps:
+    '''
+    Effective run properties of each style, resolved through basedOn chains once per document.
+    Toggle properties are stored as booleans, everything else as canonical XML
+    '''
+    def __init__(self, styles_element):
+        self._styles = {}
+        self._resolved = {}
+        self._mentions = {}
+        self.default_para = None
+        self.defaults = {}
+        self.default_toggles = set()  # Toggles set in docDefaults - how styles combine with them varies, so never strip
+
+        defaults = styles_element.find(qn('w:docDefaults') + '/' + qn('w:rPrDefault') + '/' + R_PR)
+        if defaults is not None:
+            for child in defaults:
+                if child.tag in TOGGLES:
+                    self.default_toggles.add(child.tag)
+                else:
+                    self.defaults[child.tag] = _canonical(child)
+
+        for style in styles_element.iterchildren(qn('w:style')):
+            style_id = style.get(qn('w:styleId'))
+            based_on = style.find(qn('w:basedOn'))
+            self._styles[style_id] = (based_on.get(VAL) if based_on is not None else None, style.find(R_PR))
+            if style.get(qn('w:type')) == 'paragraph' and style.get(qn('w:default')) in ('1', 'true'):
+                self.default_para = style_id
+
+    def get(self, style_id):
+        '''
+        Effective run properties of a paragraph style, including docDefaults
+        '''
+        props = self._resolved.get(style_id)
+        if props is None:
+            props = dict(self.defaults)
+            props.update(self._resolve(style_id, set()))
+            self._resolved[style_id] = props
+        return props
+
+    def mentions(self, style_id):
+        '''
+        Every rPr tag a character style (or its bases) sets, whatever the value
+        '''
+        tags = self._mentions.get(style_id)
+        if tags is None:
+            tags = self._mentions[style_id] = frozenset(self._resolve(style_id, set()))
+        return tags
+
+    def _resolve(self, style_id, seen):
+        if style_id not in self._styles or style_id in seen:
+            return {}
+        seen.add(style_id)
+        based_on, rPr = self._styles[style_id]
+        props = dict(self._resolve(based_on, seen)) if based_on else {}
+        if rPr is not None:
+            for child in rPr:
+                if child.tag in TOGGLES:
+                    props[child.tag] = props.get(child.tag, False) ^ _is_on(child)
+                else:
+                    props[child.tag] = _canonical(child)
+        return props
+
+
+def compact_runs(doc):
+    '''Merges adjacent runs with identical formatting and strips rPr entries the paragraph style already implies
+
+    Runs holding fields, footnote/endnote/comment references or drawings are left untouched, and
+    bookmarks split runs so they stay where they are.
+
+    Parameters
+    ----------
+    doc : Document or DocxTemplate object
+        Document to compact in place
+
+    Returns
+    -------
+    report : dict
+        Element count and document.xml size before and after
+    '''
+    root = doc.element
+    body = root.body
+    elements_before = sum(1 for _ in body.iter())
+    bytes_before = len(etree.tostring(root))
+    styles = _StyleRunProps(doc.styles.element)
+
+    props_removed = 0
+    runs_merged = 0
+    for p in body.iter(qn('w:p')):
+        pStyle = p.find(qn('w:pPr') + '/' + qn('w:pStyle'))
+        para_props = styles.get(pStyle.get(VAL) if pStyle is not None else styles.default_para)
+
+        containers = [p] + list(p.iter(qn('w:hyperlink'), qn('w:smartTag')))
+        for container in containers:
+            for r in container.iterchildren(R):
+                props_removed += _strip_rpr(r, para_props, styles)
+            runs_merged += _merge_runs(container)
+
+    return {
+        'elements_before': elements_before,
+        'elements_after': sum(1 for _ in body.iter()),
+        'bytes_before': bytes_before,
+        'bytes_after': len(etree.tostring(root)),
+        'runs_merged': runs_merged,
+        'props_removed': props_removed,
+    }
+
+
+def _strip_rpr(r, para_props, styles):
+    '''
+    Remove run properties that restate the effective paragraph style. Returns how many were removed
+    '''
+    rPr = r.find(R_PR)
+    if rPr is None:
+        return 0
+    rStyle = rPr.find(qn('w:rStyle'))
+    # Anything a character style touches is left alone, the direct value may be what overrides it
+    skip = styles.default_toggles
+    if rStyle is not None:
+        skip = skip | styles.mentions(rStyle.get(VAL))
+
+    removed = 0
+    for child in list(rPr):
+        if child.tag in KEEP or child.tag in skip or not isinstance(child.tag, str):
+            continue
+        if child.tag in TOGGLES:
+            redundant = _is_on(child) == para_props.get(child.tag, False)
+        else:
+            redundant = para_props.get(child.tag) == _canonical(child)
+        if redundant:
+            rPr.remove(child)
+            removed += 1
+    if len(rPr) == 0 and not rPr.attrib:
+        r.remove(rPr)
+    return removed
+
+
+def _merge_runs(container):
+    '''
+    Fold each run into the previous one when both hold only text-like content and share formatting
+    '''
+    merged = 0
+    previous = None
+    previous_key = None
+    for r in list(container.iterchildren()):
+        if r.tag != R or not _mergeable(r):
+            previous = None
+            continue
+        key = _rpr_key(r)
+        if previous is not None and key == previous_key:
+            for child in list(r):
+                if child.tag != R_PR:
+                    previous.append(child)
+            container.remove(r)
+            merged += 1
+        else:
+            previous, previous_key = r, key
+    if merged:
+        for r in container.iterchildren(R):
+            _join_text(r)
+    return merged
+
+
+def _join_text(r):
+    '''
+    Join adjacent w:t elements inside one run
+    '''
+    previous = None
+    for child in list(r):
+        if child.tag == T and previous is not None:
+            previous.text = (previous.text or '') + (child.text or '')
+            r.remove(child)
+            continue
+        previous = child if child.tag == T else None
+    for t in r.iterchildren(T):
+        text = t.text or ''
+        if text != text.strip():
+            t.set(XML_SPACE, 'preserve')
+
+
+def _mergeable(r):
+    return all(child.tag == R_PR or child.tag in MERGEABLE for child in r)
+
+
+def _rpr_key(r):
+    rPr = r.find(R_PR)
+    return _canonical(rPr) if rPr is not None else None
+
+
+def _canonical(element):
+    '''
+    Comparable form of an element: tag, sorted attributes, text and children. Serialising would drag in
+    the namespace declarations of whichever part the element sits in (styles.xml vs document.xml)
+    '''
+    return (
+        element.tag,
+        tuple(sorted(element.attrib.items())),
+        (element.text or '').strip(),
+        tuple(_canonical(child) for child in element if isinstance(child.tag, str)),
+    )
+
+
+def _is_on(element):
+    return element.get(VAL) not in ('0', 'false', 'off')
@@ -0,0 +1,162 @@
+# Streaming Word source reader
+# docx.Document() parses the whole of document.xml into one tree before anything can be copied, so a
+# 500-page source costs hundreds of MB. Here document.xml is decompressed and parsed as it is read, and
+# each top-level paragraph or table is handed over on its own and then dropped from the parse tree.
+# Peak memory follows the largest block, not the document.
+import posixpath
+
+from lxml import etree
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn  # For defining and targeting xml elements to change
+from docx.styles.styles import Styles
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+from helpers.archive import open_package
+
+DOCUMENT = 'word/document.xml'
+P = qn('w:p')
+TBL = qn('w:tbl')
+BODY = qn('w:body')
+PACKAGE_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'
+
+
+class DocxStream:
+    '''
+    Reads a .docx source one top-level block at a time.
+
+    Blocks are python-docx Paragraph and Table objects, so existing helpers such as get_para_data()
+    work on them unchanged. Styles, relationships and footnotes are read from their own (small) parts,
+    and images are only read from the package when image() asks for them.
+
+    Parameters
+    ----------
+    source : str
+        The file location of the Word source
+    '''
+    def __init__(self, source):
+        self.source = source
+        self.package = open_package(source)
+        self.part = _SourcePart(self.package)
+
+    def blocks(self):
+        '''
+        Yields each paragraph and table in the body, in document order. The section properties are skipped
+        '''
+        with self.package.stream_part(DOCUMENT) as fh:
+            for _, element in etree.iterparse(fh, events=('end',)):
+                parent = element.getparent()
+                if parent is None or parent.tag != BODY:
+                    # Still inside a block, or the document root
+                    continue
+                if element.tag in (P, TBL):
+                    # Re-parse so the block gets python-docx's element classes
+                    block = parse_xml(etree.tostring(element))
+                    parent.remove(element)
+                    yield Paragraph(block, self) if block.tag == P else Table(block, self)
+                else:
+                    parent.remove(element)
+
+    def paragraphs(self):
+        '''
+        Yields each top-level paragraph, like Document.paragraphs but without loading the document
+        '''
+        for block in self.blocks():
+            if isinstance(block, Paragraph):
+                yield block
+
+    def image(self, rId):
+        '''
+        The bytes and file name of the image related to the document by rId
+        '''
+        part = self.part.related_parts[rId]
+        return part.blob, posixpath.basename(part.partname)
+
+
+class _SourcePart:
+    '''
+    Stands in for the source's DocumentPart: what paragraphs and runs ask their part for (styles,
+    footnotes, related parts), without the document tree itself
+    '''
+    def __init__(self, package):
+        self.package = package
+        names = set(package.namelist())
+
+        self.styles = None
+        if 'word/styles.xml' in names:
+            self.styles = Styles(parse_xml(package.read('word/styles.xml')))
+
+        self._rels = {}  # rId -> (relationship type, part name)
+        rels_name = 'word/_rels/document.xml.rels'
+        if rels_name in names:
+            for rel in etree.fromstring(package.read(rels_name)).iter(PACKAGE_REL):
+                if rel.get('TargetMode') == 'External':
+                    continue
+                target = rel.get('Target')
+                partname = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('word', target))
+                self._rels[rel.get('Id')] = (rel.get('Type'), partname)
+        self._related = {}
+
+    @property
+    def related_parts(self):
+        return _RelatedParts(self)
+
+    def get_style(self, style_id, style_type):
+        if self.styles is None:
+            return None
+        return self.styles.get_by_id(style_id, style_type)
+
+    def part_related_by(self, reltype):
+        for rId, (rel_type, _) in self._rels.items():
+            if rel_type == reltype:
+                return self._load(rId)
+        raise KeyError(f'No relationship of type {reltype}')
+
+    @property
+    def _footnotes_part(self):
+        # Used by Run.footnote when no FootnoteCopier is given
+        return self.part_related_by(RT.FOOTNOTES)
+
+    def _load(self, rId):
+        part = self._related.get(rId)
+        if part is None:
+            rel_type, partname = self._rels[rId]
+            part = _Part(self.package, partname, keep=rel_type == RT.FOOTNOTES)
+            if part.keep:
+                self._related[rId] = part
+        return part
+
+
+class _RelatedParts:
+    def __init__(self, source_part):
+        self._source_part = source_part
+
+    def __getitem__(self, rId):
+        return self._source_part._load(rId)
+
+
+class _Part:
+    '''
+    A related part, read from the package on demand. Only footnotes are kept around; images are
+    read each time they are asked for so they can be freed once copied
+    '''
+    def __init__(self, package, partname, keep=False):
+        self.package = package
+        self.partname = partname
+        self.keep = keep
+        self._element = None
+
+    @property
+    def blob(self):
+        if self.keep:
+            return self.package.read(self.partname)
+        # Bypass the shared part cache, so the bytes go as soon as the image is copied
+        with self.package.stream_part(self.partname) as fh:
+            return fh.read()
+
+    @property
+    def element(self):
+        if self._element is None:
+            self._element = parse_xml(self.blob)
+        return self._element
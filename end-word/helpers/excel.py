@@ -1,7 +1,9 @@
 # Written by Reddit user _DTR_
 import re
 import xml.etree.ElementTree as ET
-import zipfile
+
+from helpers.archive import open_package
+from helpers.numfmt import NumberFormats
 
 # The following prefixes are prepended to xml tags within xlsx files.
 # Make our lives easier and give them their own variables
@@ -72,27 +74,28 @@ class Worksheet:
         rng = rng.upper()
         sep_index = rng.find(':')
         if sep_index == -1:
-            rw, col = _rw_col(rng)
+            rw, col = CellHelpers.rwcol_from_ref(rng)
             return [CellHolder(rw, col, self._cell(rw, col))]
 
         rw_first, rw_last, col_first, col_last = 4 * [1]
 
         # Need to check for entire rows/cols. These checks aren't foolproof, they aren't really meant to be
         # Assuming valid input, they do the right thing
-        if not re.match(r'\w+\d', rng[:sep_index]):
-            if (re.match(r'\w+\d', rng[sep_index + 1:])):
+        if re.fullmatch(r'\d+:\d+', rng):
+            # Entire rows
+            rw_first = int(rng[:sep_index])
+            rw_last = int(rng[sep_index + 1:])
+            col_first = 1
+            col_last = self.dim['col_last']
+        elif not re.match(r'[A-Z]+\d', rng[:sep_index]):
+            if (re.match(r'[A-Z]+\d', rng[sep_index + 1:])):
                 # invalid, can't have something like A:A1 or A:B5
                 return []
+            # Entire columns
             rw_first = 1
             rw_last = self.dim['rw_last']
             col_first = CellHelpers.col_to_num(rng[:sep_index])
             col_last = CellHelpers.col_to_num(rng[sep_index + 1:])
-        elif re.match(r'\d+:\d+', rng):
-            # Entire column
-            rw_first = int(rng[:sep_index])
-            rw_last = rw_int(rng[sep_index + 1:])
-            col_first = 1
-            col_last = self.dim['col_last']
         else:
             rw_first, col_first = CellHelpers.rwcol_from_ref(rng[:sep_index])
             rw_last, col_last = CellHelpers.rwcol_from_ref(rng[sep_index + 1:])
@@ -135,7 +138,8 @@ class CellHelpers:
     '''
     Class containing helper methods for converting between row/col and A1 reference styles
     '''
-    def col_to_num(self, col):
+    @staticmethod
+    def col_to_num(col):
         '''
         Convert the given A1 column to a 1-based index
         '''
@@ -146,16 +150,18 @@ class CellHelpers:
         else:
             return 702 + (676 * (ord(col[0]) - ord('A'))) + (26 * (ord(col[1]) - ord('A'))) + (ord(col[2]) - ord('A')) + 1
 
-    def rwcol_from_ref(self, ref):
+    @staticmethod
+    def rwcol_from_ref(ref):
         '''
         Convert a single-cell A1 reference to a row and column
         '''
         index = 0
         while ord(ref[index]) < ord('0') or ord(ref[index]) > ord('9'):
             index += 1
-        return int(ref[index:]), self.col_to_num(ref[:index])
+        return int(ref[index:]), CellHelpers.col_to_num(ref[:index])
 
-    def num_to_col(self, num):
+    @staticmethod
+    def num_to_col(num):
         '''
         Convert a column index into an A1 reference
         '''
@@ -171,17 +177,19 @@ class CellHelpers:
 
         return val + chr(num + ord('A'))
 
-    def a1(self, rw, col):
+    @staticmethod
+    def a1(rw, col):
         '''
         Convert a row and column index to an A1 reference string
         '''
-        return self.num_to_col(col) + str(rw)
+        return CellHelpers.num_to_col(col) + str(rw)
 
-    def build_range(self, rw_first, rw_last, col_first, col_last):
+    @staticmethod
+    def build_range(rw_first, rw_last, col_first, col_last):
         '''
         Builds a reference string within the four conrer bounds
         '''
-        return self.num_to_col(col_first) + str(rw_first) + ":" + self.num_to_col(col_last) + str(rw_last)
+        return CellHelpers.num_to_col(col_first) + str(rw_first) + ":" + CellHelpers.num_to_col(col_last) + str(rw_last)
 
 
 class CellHolder:
@@ -223,14 +231,26 @@ class SharedString:
         for run in self.runs:
             run.text = run.text.replace(find, rep)
 
-    def add_to_paragraph(self, p):
+    def add_to_paragraph(self, p, registry=None):
         '''
         Add this string to the given docx paragraph. Probably shouldn't be a part of this class
+        If a CharStyleRegistry is given, formatting is applied as a shared character style
         '''
         for run in self.runs:
             docRun = p.add_run(run.to_string())
 
             # For now, only look at super/subscript, bold, underline, and italic
+            if registry is not None:
+                registry.apply(
+                    docRun,
+                    bold=True if run.has_attr('b') else None,
+                    italic=True if run.has_attr('i') else None,
+                    underline=True if run.has_attr('u') else None,
+                    subscript=True if run.attrib('vertAlign') == 'subscript' else None,
+                    superscript=True if run.attrib('vertAlign') == 'superscript' else None,
+                )
+                continue
+
             if run.has_attr('vertAlign'):
                 if run.attrib('vertAlign') == 'subscript':
                     docRun.font.subscript = True
@@ -304,28 +324,35 @@ class Run:
     def has_attr(self, attr):
         return attr in self.properties
 
-def custom_load_workbook(source_file):
+def custom_load_workbook(source_file, sheets=None):
     '''
     Reads in the given workbook file and returns a Workbook object containing its sheets and cell values
+    Sheets are added in workbook order. Pass a list of sheet names as sheets to only parse those
     '''
 
     # This assumes an xlsx file that has all the required parts
-    container = zipfile.ZipFile(source_file)
-    stringFile = ET.parse(container.open('xl/sharedStrings.xml'))
-
+    container = open_package(source_file)
 
     # Build up our list of shared strings
+    # Workbooks with only numbers, or only inline strings, have no shared strings part
     strings = []
-    for child in stringFile.getroot():
-        text = SharedString()
-        for run in child:
-            text.add_run(run)
-        strings.append(text)
+    if 'xl/sharedStrings.xml' in container.namelist():
+        stringFile = ET.parse(container.open('xl/sharedStrings.xml'))
+        for child in stringFile.getroot():
+            text = SharedString()
+            for run in child:
+                text.add_run(run)
+            strings.append(text)
+
+    # Workbook properties are needed up front for the date system used by number formats
+    workbook = ET.parse(container.open('xl/workbook.xml'))
 
     # Build up our list of styles
     cell_styles = []
+    number_formats = NumberFormats()
     if 'xl/styles.xml' in container.namelist():
         style = ET.parse(container.open('xl/styles.xml'))
+        number_formats = NumberFormats.from_xml(style.getroot(), workbook.getroot())
         fonts_xml = style.getroot().find(PREFIX + 'fonts')
         fonts = []
         for font in fonts_xml:
@@ -342,60 +369,88 @@ def custom_load_workbook(source_file):
         index = 0
         for xf in cellxfs:
             cell_styles.append({})
-            # Only care about font properties for now
+            # Only care about font properties and number formats for now
             if 'fontId' in xf.attrib:
                 fid = int(xf.attrib['fontId'])
                 cell_styles[index]['font'] = fonts[fid]
             else:
                 cell_styles[index]['font'] = {}
+            cell_styles[index]['numFmtId'] = int(xf.attrib.get('numFmtId', 0))
             index += 1
 
 
     wb = Workbook()
 
-    # Get the friendly names of the sheets
-    sheetNames = {}
-    workbook = ET.parse(container.open('xl/workbook.xml'))
+    # Get the friendly names of the sheets, and the part each one is stored in
+    # Part names do not follow sheet ids or order, so go through the workbook relationships
+    rels = ET.parse(container.open('xl/_rels/workbook.xml.rels'))
+    targets = {rel.attrib['Id']: rel.attrib['Target'] for rel in rels.getroot()}
+    view = workbook.getroot().find(PREFIX + 'bookViews/' + PREFIX + 'workbookView')
+    active_tab = int(view.attrib.get('activeTab', 0)) if view is not None else 0
     elements = workbook.getroot().findall(PREFIX + 'sheets/' + PREFIX + 'sheet')
-    for sheet in elements:
-        sheetNames[sheet.attrib['sheetId']] = { 'name' : sheet.attrib['name'] }
 
     # now go through our worksheets and find matching string entries
-    xmlSheets = [file for file in container.namelist() if file[0:16] == 'xl/worksheets/sh']
-    for xmlSheet in xmlSheets:
+    for tab, sheet in enumerate(elements):
+        name = sheet.attrib['name']
+        target = targets[sheet.attrib[REL + 'id']]
+        xmlSheet = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+        if (sheets is not None and name not in sheets) or 'worksheets/' not in xmlSheet:
+            # Not asked for, or a chartsheet with no cells
+            continue
         ws = Worksheet()
-        name = sheetNames[xmlSheet[xmlSheet.find('/sheet') + 6:xmlSheet.rfind('.')]]['name']
-        active = False
-        if xmlSheet.find(PREFIX + '/sheetViews' + PREFIX + '/sheetView[@tabSelected="1"]'):
-            active = True
+        active = tab == active_tab
         tree = ET.parse(container.open(xmlSheet))
         data = tree.getroot().find(PREFIX + 'sheetData')
         cells = data.findall(PREFIX + 'row/' + PREFIX + 'c')
+
+        # Numeric cells are collected per (column, style) and formatted in batches afterwards,
+        # so each column only looks up its compiled formatter once
+        numeric = {}
         for cell in cells:
-            cell_value = None
             # Cell attributes:
             # https://docs.microsoft.com/en-us/dotnet/api/documentformat.openxml.spreadsheet.cell?view=openxml-2.8.1
-            if ('t' in cell.attrib and cell.attrib['t'] == 's'):
+            cell_type = cell.attrib.get('t', 'n')
+            if cell_type == 's':
                 # We have a shared string
                 ws.add_cell(cell.attrib['r'], strings[int(cell.find(PREFIX + 'v').text)])
+                continue
+
+            properties = None
+            style_id = int(cell.attrib.get('s', 0))
+            if ('s' in cell.attrib):
+                properties = cell_styles[style_id]['font']
+
+            if cell_type == 'inlineStr':
+                text = SharedString()
+                for run in cell.find(PREFIX + 'is'):
+                    text.add_run(run)
+                ws.add_cell(cell.attrib['r'], text)
+                continue
+
+            value = cell.find(PREFIX + 'v')
+            if value is None or value.text is None:
+                # Will catch blank cells, i.e. merged cells
+                continue
+
+            if cell_type == 'n':
+                column = cell.attrib['r'].rstrip('0123456789')
+                numeric.setdefault((column, style_id), []).append((cell.attrib['r'], value.text, properties))
+            elif cell_type == 'b':
+                ws.add_cell(cell.attrib['r'], SharedString('TRUE' if value.text == '1' else 'FALSE', properties=properties))
             else:
-                # otherwise we just have the value.
-                properties = None
-                if ('s' in cell.attrib):
-                    style_id = int(cell.attrib['s'])
-                    properties = cell_styles[style_id]['font']
-                
-                # Format numbers as desired
-                try:
-                    cell_value = cell.find(PREFIX + 'v').text
-                    cell_value = f'{float(cell_value):.2f}'
-                except AttributeError as e:
-                    # Will catch blank cells, i.e. merged cells
-#                     print(f'Cell {cell.attrib["r"]} is blank...skipping\n')
-                    pass
-                
-                if cell_value:
-                    ws.add_cell(cell.attrib['r'], SharedString(cell_value, properties=properties))
+                # Formula strings, errors and ISO dates are shown as stored
+                ws.add_cell(cell.attrib['r'], SharedString(value.text, properties=properties))
+
+        # Format numbers as they are displayed in Excel
+        for (column, style_id), batch in numeric.items():
+            num_fmt_id = cell_styles[style_id]['numFmtId'] if style_id < len(cell_styles) else 0
+            texts = number_formats.format_batch(num_fmt_id, [raw for _, raw, _ in batch])
+            for (ref, _, properties), text in zip(batch, texts):
+                if text:
+                    ws.add_cell(ref, SharedString(text, properties=properties))
         wb.add_sheet(ws, name, active)
-    
+
+    if wb.active is None and wb.sheets:
+        # The active sheet was filtered out
+        wb.active = next(iter(wb.sheets.values()))
     return wb
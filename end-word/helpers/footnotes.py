@@ -0,0 +1,109 @@
+import copy
+import weakref
+
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml import OxmlElement  # For defining and targeting xml elements to change
+from docx.oxml.ns import qn  # For defining and targeting xml elements to change
+
+# Footnote copying
+# Paragraph.add_footnote() scans the destination footnotes for the next id and Run.footnote scans the
+# source footnotes for the body, on every call - quadratic for footnote-heavy documents, and only the
+# plain text survives. Here each source is indexed once, ids are remapped as references are copied,
+# and whole footnote bodies (formatting included) are appended to the destination in one go.
+
+FOOTNOTE = qn('w:footnote')
+FOOTNOTE_REF = qn('w:footnoteReference')
+HYPERLINK = qn('w:hyperlink')
+ID = qn('w:id')
+R_ID = qn('r:id')
+
+
+class FootnoteCopier:
+    '''
+    Copies footnotes from source documents into the destination's footnotes part.
+
+    Call reference() for each run holding a footnoteReference, then flush() once the source has been
+    copied to write the footnote bodies in bulk.
+
+    Parameters
+    ----------
+    dest : Document or DocxTemplate object
+        The destination word doc
+    '''
+    def __init__(self, dest):
+        self.dest = dest
+        self._sources = weakref.WeakKeyDictionary()  # source part -> (footnotes by id, source id -> dest id)
+        self._pending = []
+        self._next_id = None
+        self.copied = 0
+
+    def reference(self, dest_run, src_part, src_id):
+        '''
+        Add a reference to the copy of footnote src_id (from the source document part) to dest_run.
+        Returns the destination footnote id, or None when the source has no such footnote.
+        '''
+        by_id, remap = self._index(src_part)
+        dest_id = remap.get(src_id)
+        if dest_id is None:
+            footnote = by_id.get(src_id)
+            if footnote is None:
+                return None
+            dest_id = self._copy(footnote)
+            remap[src_id] = dest_id
+
+        r = dest_run._r
+        rPr = r.get_or_add_rPr()
+        if rPr.find(qn('w:rStyle')) is None:
+            rPr.style = 'FootnoteReference'
+        reference = OxmlElement('w:footnoteReference')
+        reference.set(ID, str(dest_id))
+        r.append(reference)
+        return dest_id
+
+    def flush(self):
+        '''
+        Append every footnote copied since the last flush to the destination footnotes part
+        '''
+        if self._pending:
+            self._footnotes().extend(self._pending)
+            self._pending = []
+        # Anything else may add footnotes between sources, so read the next id again when needed
+        self._next_id = None
+
+    def _index(self, src_part):
+        entry = self._sources.get(src_part)
+        if entry is None:
+            by_id = {}
+            try:
+                footnotes = src_part.part_related_by(RT.FOOTNOTES).element
+            except KeyError:
+                footnotes = None
+            if footnotes is not None:
+                for footnote in footnotes.iterchildren(FOOTNOTE):
+                    if footnote.get(qn('w:type')) in (None, 'normal'):
+                        by_id[int(footnote.get(ID))] = footnote
+            entry = self._sources[src_part] = (by_id, {})
+        return entry
+
+    def _copy(self, footnote):
+        if self._next_id is None:
+            ids = [int(fn.get(ID)) for fn in self._footnotes().iterchildren(FOOTNOTE)]
+            self._next_id = max(ids + [0]) + 1
+        dest_id = self._next_id
+        self._next_id += 1
+
+        body = copy.deepcopy(footnote)
+        body.set(ID, str(dest_id))
+        # Relationship ids belong to the source footnotes part, so hyperlinks are kept as plain runs
+        for link in list(body.iter(HYPERLINK)):
+            if link.get(R_ID) is not None:
+                for child in list(link):
+                    link.addprevious(child)
+                link.getparent().remove(link)
+        self._pending.append(body)
+        self.copied += 1
+        return dest_id
+
+    def _footnotes(self):
+        # Creates the default footnotes part (with separators) if the template has none
+        return self.dest.part._footnotes_part.element
@@ -0,0 +1,606 @@
+# Excel number formats -> display strings
+# Format codes are parsed once into formatter callables and cached, so a workbook with thousands of
+# cells sharing a handful of formats only pays the parsing cost once per format.
+# Spec: ECMA-376 Part 1, 18.8.30 (numFmt) and 18.8.31 (numFmts)
+import datetime
+import re
+from decimal import Decimal, ROUND_HALF_UP
+from fractions import Fraction
+from functools import lru_cache
+
+PREFIX = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+# Built-in formats that are not written to styles.xml
+# 14 is locale dependent. Excel shows m/d/yyyy for en-US, which is what we mirror here
+BUILTIN_FORMATS = {
+    0: 'General',
+    1: '0',
+    2: '0.00',
+    3: '#,##0',
+    4: '#,##0.00',
+    5: '"$"#,##0_);("$"#,##0)',
+    6: '"$"#,##0_);[Red]("$"#,##0)',
+    7: '"$"#,##0.00_);("$"#,##0.00)',
+    8: '"$"#,##0.00_);[Red]("$"#,##0.00)',
+    9: '0%',
+    10: '0.00%',
+    11: '0.00E+00',
+    12: '# ?/?',
+    13: '# ??/??',
+    14: 'm/d/yyyy',
+    15: 'd-mmm-yy',
+    16: 'd-mmm',
+    17: 'mmm-yy',
+    18: 'h:mm AM/PM',
+    19: 'h:mm:ss AM/PM',
+    20: 'h:mm',
+    21: 'h:mm:ss',
+    22: 'm/d/yyyy h:mm',
+    37: '#,##0 ;(#,##0)',
+    38: '#,##0 ;[Red](#,##0)',
+    39: '#,##0.00;(#,##0.00)',
+    40: '#,##0.00;[Red](#,##0.00)',
+    41: '_(* #,##0_);_(* (#,##0);_(* "-"_);_(@_)',
+    42: '_("$"* #,##0_);_("$"* (#,##0);_("$"* "-"_);_(@_)',
+    43: '_(* #,##0.00_);_(* (#,##0.00);_(* "-"??_);_(@_)',
+    44: '_("$"* #,##0.00_);_("$"* (#,##0.00);_("$"* "-"??_);_(@_)',
+    45: 'mm:ss',
+    46: '[h]:mm:ss',
+    47: 'mmss.0',
+    48: '##0.0E+0',
+    49: '@',
+}
+
+DATE_TOKENS = re.compile(
+    r'\[(?:h+|m+|s+)\]|yyyy|yy|m{1,5}|d{1,4}|h{1,2}|s{1,2}|AM/PM|A/P|\.0{1,3}',
+    re.IGNORECASE
+)
+BRACKETS = re.compile(r'\[[^\]]*\]')
+QUOTED = re.compile(r'"[^"]*"')
+CONDITION = re.compile(r'\[(<>|<=|>=|<|>|=)\s*(-?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)\]')
+COMPARE = {
+    '<': lambda value, limit: value < limit,
+    '<=': lambda value, limit: value <= limit,
+    '>': lambda value, limit: value > limit,
+    '>=': lambda value, limit: value >= limit,
+    '=': lambda value, limit: value == limit,
+    '<>': lambda value, limit: value != limit,
+}
+NONZERO = re.compile(r'[1-9]')
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December']
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+class NumberFormats:
+    '''
+    Formatter lookup for a single workbook. Format codes from styles.xml are compiled lazily
+    on first use and then served from a dict keyed by numFmtId
+    '''
+    def __init__(self, codes=None, date1904=False):
+        self.codes = dict(BUILTIN_FORMATS)
+        if codes:
+            self.codes.update(codes)
+        self.date1904 = date1904
+        self._compiled = {}
+
+    @classmethod
+    def from_xml(cls, style_root, workbook_root=None):
+        '''
+        Build the lookup from a parsed styles.xml root (and optionally workbook.xml for the 1904 date system)
+        '''
+        codes = {}
+        num_fmts = style_root.find(PREFIX + 'numFmts') if style_root is not None else None
+        if num_fmts is not None:
+            for num_fmt in num_fmts:
+                codes[int(num_fmt.attrib['numFmtId'])] = num_fmt.attrib['formatCode']
+
+        date1904 = False
+        if workbook_root is not None:
+            wb_pr = workbook_root.find(PREFIX + 'workbookPr')
+            if wb_pr is not None:
+                date1904 = wb_pr.attrib.get('date1904') in ('1', 'true')
+        return cls(codes, date1904)
+
+    def formatter(self, num_fmt_id):
+        '''
+        Return the compiled formatter for a numFmtId. Unknown ids fall back to General
+        '''
+        try:
+            return self._compiled[num_fmt_id]
+        except KeyError:
+            fmt = compile_format(self.codes.get(num_fmt_id, 'General'), self.date1904)
+            self._compiled[num_fmt_id] = fmt
+            return fmt
+
+    def format_batch(self, num_fmt_id, values):
+        '''
+        Format a batch of raw cell values (strings from <v>) that share one number format
+        '''
+        fmt = self.formatter(num_fmt_id)
+        return [fmt(float(value)) for value in values]
+
+
+@lru_cache(maxsize=None)
+def compile_format(code, date1904=False):
+    '''
+    Compile an Excel format code into a callable taking a float and returning the displayed text.
+
+    Up to four ';' separated sections are supported (positive;negative;zero;text). An empty section
+    hides the values it covers, so '#,##0;;' shows nothing for negatives and zero. Colours and
+    locale tags are dropped, '_x' padding becomes a single space and '*x' fills are ignored, so the
+    output is the text Excel shows without the column-width dependent padding.
+
+    Sections may instead start with a condition such as [>=1000]. The first section whose condition
+    holds is used, otherwise the first section without one (General if every section has one).
+    Conditional sections show negative values with their minus sign.
+    '''
+    sections = _split_sections(code)[:3]
+    compiled = [
+        _blank if len(sections) > 1 and _is_empty(section) else _compile_section(section, date1904)
+        for section in sections
+    ]
+    conditions = [_condition(section) for section in sections]
+
+    if any(conditions):
+        fallback = next((section for section, condition in zip(compiled, conditions) if condition is None), _general)
+        choices = [(condition, _signed(section)) for condition, section in zip(conditions, compiled) if condition]
+        fallback = _signed(fallback)
+
+        def fmt(value):
+            for (compare, limit), section in choices:
+                if compare(value, limit):
+                    return section(value)
+            return fallback(value)
+        return fmt
+
+    if len(compiled) == 1:
+        return _signed(compiled[0])
+
+    positive = compiled[0]
+    negative = compiled[1]
+    zero = compiled[2] if len(compiled) > 2 else positive
+
+    def fmt(value):
+        if value > 0:
+            return positive(value)
+        if value < 0:
+            # The negative section supplies its own sign or brackets
+            return negative(-value)
+        return zero(value)
+    return fmt
+
+
+def _signed(section):
+    '''
+    A section that formats the magnitude of negative values and puts the minus sign in front
+    '''
+    if section.is_date or section.is_general:
+        return section
+
+    def fmt(value):
+        if value < 0:
+            text = section(-value)
+            # Values that round to zero lose their sign
+            return '-' + text if NONZERO.search(text) else text
+        return section(value)
+    fmt.is_date = False
+    fmt.is_general = False
+    return fmt
+
+
+def _condition(section):
+    '''
+    The (comparison, limit) of a conditional section like [>=1000]#,##0, or None
+    '''
+    match = CONDITION.search(QUOTED.sub('', section))
+    if match is None:
+        return None
+    return COMPARE[match.group(1)], float(match.group(2))
+
+
+def _is_empty(section):
+    '''
+    Whether a section shows nothing: no placeholders and no literal text, only colour or condition tags
+    '''
+    return not BRACKETS.sub('', section).strip()
+
+
+def _split_sections(code):
+    '''
+    Split a format code on ';' while respecting quoted literals and escapes
+    '''
+    sections = ['']
+    in_quote = False
+    escape = False
+    for char in code:
+        if escape:
+            sections[-1] += char
+            escape = False
+        elif char == '\\':
+            sections[-1] += char
+            escape = True
+        elif char == '"':
+            sections[-1] += char
+            in_quote = not in_quote
+        elif char == ';' and not in_quote:
+            sections.append('')
+        else:
+            sections[-1] += char
+    return sections
+
+
+def _tokenize(section):
+    '''
+    Break a section into ('lit', text) and ('code', text) tokens
+    '''
+    tokens = []
+    i = 0
+    while i < len(section):
+        char = section[i]
+        if char == '"':
+            end = section.find('"', i + 1)
+            end = len(section) if end == -1 else end
+            tokens.append(('lit', section[i + 1:end]))
+            i = end + 1
+        elif char == '\\' and i + 1 < len(section):
+            tokens.append(('lit', section[i + 1]))
+            i += 2
+        elif char == '_' and i + 1 < len(section):
+            tokens.append(('lit', ' '))
+            i += 2
+        elif char == '*' and i + 1 < len(section):
+            i += 2
+        elif char == '[':
+            end = section.find(']', i)
+            end = len(section) if end == -1 else end
+            tag = section[i:end + 1]
+            if tag.startswith('[$') and '-' in tag:
+                # Currency tags look like [$€-407]; keep the symbol, drop the locale
+                tokens.append(('lit', tag[2:tag.find('-')]))
+            elif re.match(r'\[(h+|m+|s+)\]$', tag, re.IGNORECASE):
+                tokens.append(('code', tag))
+            i = end + 1
+        else:
+            tokens.append(('code', char))
+            i += 1
+    return tokens
+
+
+def _compile_section(section, date1904):
+    tokens = _tokenize(section)
+    code = ''.join(text for kind, text in tokens if kind == 'code')
+    bare = BRACKETS.sub('', code)
+
+    if bare.strip().lower() in ('general', ''):
+        if not any(kind == 'lit' for kind, _ in tokens):
+            return _general
+    if bare.strip() == '@':
+        return _literal_formatter(tokens)
+    if re.search(r'[ymdhs]', bare, re.IGNORECASE) or re.search(r'\[(h+|m+|s+)\]', code, re.IGNORECASE):
+        return _date_formatter(tokens, date1904)
+    return _number_formatter(tokens)
+
+
+def _blank(value):
+    return ''
+_blank.is_date = False
+_blank.is_general = False
+
+
+def _general(value):
+    '''
+    Excel's General format. Integers are shown whole, other values to ten significant digits
+    '''
+    if value == int(value) and abs(value) < 1e11:
+        return str(int(value))
+    magnitude = abs(value)
+    if magnitude >= 1e11 or magnitude < 1e-9:
+        mantissa, exponent = f'{value:.5E}'.split('E')
+        mantissa = mantissa.rstrip('0').rstrip('.')
+        return f'{mantissa}E{exponent[0]}{exponent[1:].zfill(2)}'
+    return f'{value:.10g}'
+_general.is_date = False
+_general.is_general = True
+
+
+def _literal_formatter(tokens):
+    parts = [text for _, text in tokens]
+
+    def fmt(value):
+        return ''.join(_general(value) if part == '@' else part for part in parts).strip()
+    fmt.is_date = False
+    fmt.is_general = False
+    return fmt
+
+
+def _round_half_up(value, places):
+    '''
+    Round like Excel does, working from the shortest repr so 2.675 rounds to 2.68
+    '''
+    quantum = Decimal(1).scaleb(-places)
+    return Decimal(repr(value)).quantize(quantum, rounding=ROUND_HALF_UP)
+
+
+def _fixed(value, places, spec=None):
+    '''
+    Fixed-point text for a non-negative value. Float formatting agrees with Excel except when the
+    shortest repr ends exactly on a 5 at the rounding position, so only that case goes through Decimal
+    '''
+    spec = spec or f'.{places}f'
+    text = repr(value)
+    point = text.find('.')
+    if 'e' not in text and (point == -1 or len(text) - point - 1 != places + 1 or text[-1] != '5'):
+        return format(value, spec)
+    return format(_round_half_up(value, places), spec)
+
+
+def _number_formatter(tokens):
+    '''
+    Compile the numeric part of a section. Everything before the first digit placeholder is a prefix
+    and everything after the last is a suffix.
+    '''
+    placeholders = '0#?'
+    codes = [(i, text) for i, (kind, text) in enumerate(tokens) if kind == 'code']
+    # Digits after a '/' are a fixed denominator (# ?/4), part of the number rather than a suffix
+    slash = next((i for i, text in codes if text == '/'), len(tokens))
+    digit_positions = [i for i, text in codes if text in placeholders or (i > slash and text.isdigit())]
+
+    if not digit_positions:
+        # Pure literal section such as "-" for zero values
+        text = ''.join(text for _, text in tokens if text != '@')
+
+        def fmt(value):
+            return text.strip()
+        fmt.is_date = False
+        fmt.is_general = False
+        return fmt
+
+    first, last = digit_positions[0], digit_positions[-1]
+    # Exponent markers can follow the last placeholder, e.g. 0.00E+00
+    body_end = last
+    for i, text in codes:
+        if i > last:
+            break
+        body_end = i
+    pattern = ''.join(tokens[i][1] for i in range(first, body_end + 1) if tokens[i][0] == 'code')
+    prefix = [(kind, text) for kind, text in tokens[:first]]
+    suffix = [(kind, text) for kind, text in tokens[body_end + 1:]]
+
+    # Commas directly after the last placeholder scale by 1000 each
+    scale = 0
+    while suffix and suffix[0] == ('code', ','):
+        scale += 1
+        suffix = suffix[1:]
+
+    percent = sum(1 for kind, text in prefix + suffix if kind == 'code' and text == '%')
+    prefix_text = ''.join(text for _, text in prefix)
+    suffix_text = ''.join(text for _, text in suffix)
+
+    exponent = None
+    mantissa = pattern
+    match = re.search(r'[eE]([+-])', pattern)
+    if match:
+        mantissa = pattern[:match.start()]
+        exponent = (match.group(1), pattern[match.end():].count('0'))
+
+    int_part, _, dec_part = mantissa.partition('.')
+    thousands = ',' in int_part
+    int_part = int_part.replace(',', '')
+    min_int = int_part.count('0')
+    dec_places = len(dec_part)
+    min_dec = len(dec_part.rstrip('#?'))
+    space_dec = len(dec_part) - len(dec_part.rstrip('?'))
+    fraction = '/' in pattern
+    factor = (100 ** percent) / (1000 ** scale)
+
+    if not fraction and not exponent and min_int == 1 and min_dec == dec_places:
+        # Fast path for the common fixed-point codes (0.00, #,##0, 0%, accounting formats, ...)
+        spec = (',' if thousands else '') + f'.{dec_places}f'
+
+        def fmt(value):
+            if factor != 1:
+                value = value * factor
+            return (prefix_text + _fixed(value, dec_places, spec) + suffix_text).strip()
+        fmt.is_date = False
+        fmt.is_general = False
+        return fmt
+
+    def fmt(value):
+        value = value * factor
+
+        if fraction:
+            text = _fraction(value, pattern)
+        elif exponent:
+            text = _scientific(value, int_part, dec_places, min_dec, exponent)
+        else:
+            whole, _, frac = _fixed(value, dec_places).partition('.')
+            whole = whole.lstrip('0')
+            if len(whole) < min_int:
+                whole = whole.zfill(min_int)
+            if thousands and len(whole) > 3:
+                whole = f'{int(whole):,}'
+            if dec_places:
+                frac = frac.ljust(dec_places, '0')
+                trimmed = frac.rstrip('0')
+                if len(trimmed) < min_dec:
+                    trimmed = frac[:min_dec]
+                pad = dec_places - len(trimmed)
+                trimmed += ' ' * min(pad, space_dec)
+                text = f'{whole}.{trimmed}' if trimmed.strip() or dec_part.startswith('0') else whole + '.'
+            else:
+                text = whole
+        return (prefix_text + text + suffix_text).strip()
+    fmt.is_date = False
+    fmt.is_general = False
+    return fmt
+
+
+def _scientific(value, int_part, dec_places, min_dec, exponent):
+    sign, exp_digits = exponent
+    if value == 0:
+        power = 0
+    else:
+        # Engineering style codes (##0.0E+0) step the exponent in multiples of the integer width
+        step = max(len(int_part), 1) if '#' in int_part else 1
+        power = int(Decimal(repr(value)).adjusted())
+        power -= power % step
+    mantissa = _round_half_up(value / (10 ** power), dec_places)
+    if abs(mantissa) >= 10 ** max(len(int_part), 1) and value != 0:
+        power += 1
+        mantissa = _round_half_up(value / (10 ** power), dec_places)
+    digits = f'{mantissa:f}'
+    if dec_places > min_dec and '.' in digits:
+        digits = digits.rstrip('0')
+        whole, _, frac = digits.partition('.')
+        digits = whole + '.' + frac.ljust(min_dec, '0') if (frac or min_dec) else whole
+    exp_sign = '-' if power < 0 else ('+' if sign == '+' else '')
+    return f'{digits}E{exp_sign}{str(abs(power)).zfill(exp_digits)}'
+
+
+def _fraction(value, pattern):
+    whole_part, _, frac_part = pattern.partition(' ')
+    denominator = frac_part.split('/')[-1] if frac_part else pattern.split('/')[-1]
+    # A denominator like 4 or 16 is fixed; ?, # and 0 placeholders let the denominator vary
+    fixed = re.fullmatch(r'[1-9]\d*', denominator) is not None
+    whole = int(value) if frac_part else 0
+    if fixed:
+        frac = Fraction(int(_round_half_up(value - whole, 9) * int(denominator) + Decimal('0.5')), int(denominator))
+    else:
+        frac = Fraction(repr(value - whole)).limit_denominator(10 ** len(denominator) - 1)
+    if frac == 1:
+        whole, frac = whole + 1, Fraction(0)
+    if frac == 0:
+        return str(whole)
+    if fixed:
+        frac_text = f'{frac * int(denominator)}/{denominator}'
+    else:
+        frac_text = f'{frac.numerator}/{frac.denominator}'
+    return f'{whole} {frac_text}' if whole else frac_text
+
+
+def _date_formatter(tokens, date1904):
+    '''
+    Compile a date/time section. 'm' means minutes when it follows an hour or precedes a second token
+    '''
+    parts = []
+    for kind, text in tokens:
+        if kind == 'lit':
+            parts.append(('lit', text))
+            continue
+        parts.append(('code', text))
+
+    # Merge adjacent code characters and re-split them into date tokens
+    merged = []
+    for kind, text in parts:
+        if kind == 'code' and merged and merged[-1][0] == 'code':
+            merged[-1] = ('code', merged[-1][1] + text)
+        else:
+            merged.append((kind, text))
+
+    fields = []
+    for kind, text in merged:
+        if kind == 'lit':
+            fields.append(('lit', text))
+            continue
+        pos = 0
+        for match in DATE_TOKENS.finditer(text):
+            if match.start() > pos:
+                fields.append(('lit', text[pos:match.start()]))
+            fields.append(('tok', match.group(0)))
+            pos = match.end()
+        if pos < len(text):
+            fields.append(('lit', text[pos:]))
+
+    # Resolve month vs minute ambiguity
+    tok_idx = [i for i, (kind, _) in enumerate(fields) if kind == 'tok']
+    for n, i in enumerate(tok_idx):
+        tok = fields[i][1].lower()
+        if tok in ('m', 'mm'):
+            prev_tok = fields[tok_idx[n - 1]][1].lower() if n > 0 else ''
+            next_tok = fields[tok_idx[n + 1]][1].lower() if n + 1 < len(tok_idx) else ''
+            if prev_tok.startswith('h') or prev_tok.startswith('[h') or next_tok.startswith('s'):
+                fields[i] = ('tok', 'min' if tok == 'm' else 'mmin')
+
+    twelve_hour = any(kind == 'tok' and text.upper() in ('AM/PM', 'A/P') for kind, text in fields)
+    sub_second = max((len(text) - 1 for kind, text in fields if kind == 'tok' and text.startswith('.')), default=0)
+
+    def fmt(value):
+        try:
+            dt, elapsed, leap_day = _from_serial(value, date1904, sub_second)
+        except (OverflowError, ValueError):
+            # Excel fills the cell with hashes for negative or out of range dates
+            return '########'
+        out = []
+        for kind, text in fields:
+            if kind == 'lit':
+                out.append(text)
+                continue
+            tok = text.lower()
+            if tok == 'yyyy':
+                out.append(f'{dt.year:04d}')
+            elif tok == 'yy':
+                out.append(f'{dt.year % 100:02d}')
+            elif tok == 'mmmmm':
+                out.append(MONTHS[dt.month - 1][0])
+            elif tok == 'mmmm':
+                out.append(MONTHS[dt.month - 1])
+            elif tok == 'mmm':
+                out.append(MONTHS[dt.month - 1][:3])
+            elif tok == 'mm':
+                out.append(f'{dt.month:02d}')
+            elif tok == 'm':
+                out.append(str(dt.month))
+            elif tok == 'dddd':
+                out.append(DAYS[dt.weekday()])
+            elif tok == 'ddd':
+                out.append(DAYS[dt.weekday()][:3])
+            elif tok == 'dd':
+                out.append('29' if leap_day else f'{dt.day:02d}')
+            elif tok == 'd':
+                out.append('29' if leap_day else str(dt.day))
+            elif tok in ('h', 'hh'):
+                hour = (dt.hour % 12 or 12) if twelve_hour else dt.hour
+                out.append(f'{hour:02d}' if tok == 'hh' else str(hour))
+            elif tok in ('min', 'mmin'):
+                out.append(f'{dt.minute:02d}' if tok == 'mmin' else str(dt.minute))
+            elif tok in ('s', 'ss'):
+                out.append(f'{dt.second:02d}' if tok == 'ss' else str(dt.second))
+            elif tok.startswith('.'):
+                digits = len(tok) - 1
+                out.append('.' + f'{dt.microsecond:06d}'[:digits])
+            elif tok.startswith('[h'):
+                out.append(str(int(elapsed // 3600)).zfill(len(tok) - 2))
+            elif tok.startswith('[m'):
+                out.append(str(int(elapsed // 60)).zfill(len(tok) - 2))
+            elif tok.startswith('[s'):
+                out.append(str(int(elapsed)).zfill(len(tok) - 2))
+            elif tok == 'am/pm':
+                out.append('AM' if dt.hour < 12 else 'PM')
+            elif tok == 'a/p':
+                out.append('A' if dt.hour < 12 else 'P')
+        return ''.join(out).strip()
+    fmt.is_date = True
+    fmt.is_general = False
+    return fmt
+
+
+def _from_serial(value, date1904, sub_second=0):
+    '''
+    Convert an Excel serial date to a datetime, plus the elapsed seconds for [h]/[m]/[s] codes and whether
+    the serial is Excel's fake 29 Feb 1900 (returned as the 28th, which falls on the weekday Excel shows).
+    Times are rounded to the displayed precision first so 0.99999999 shows as the next day, like Excel.
+    '''
+    if value < 0:
+        raise ValueError('Excel dates cannot be negative')
+    elapsed = round(value * 86400, sub_second)
+    days, seconds = divmod(elapsed, 86400)
+    if date1904:
+        epoch = datetime.datetime(1904, 1, 1)
+    elif days < 60:
+        # Excel treats 1900 as a leap year. Serials before the fake 29 Feb are off by one
+        epoch = datetime.datetime(1899, 12, 31)
+    else:
+        epoch = datetime.datetime(1899, 12, 30)
+    leap_day = not date1904 and days == 60
+    return epoch + datetime.timedelta(days=days, seconds=seconds), elapsed, leap_day
@@ -0,0 +1,158 @@
+# Per-sheet Excel conversion
+# Every worksheet is converted on its own into plain, picklable data (cell text runs, cell formats and
+# merged ranges), so the sheets of a large workbook can be converted in parallel across processes.
+# Writing the Word tables stays in the main process, python-docx documents cannot be shared.
+import os
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+from openpyxl import load_workbook
+from openpyxl import styles
+
+from helpers.archive import open_package, process_pool
+from helpers.excel import custom_load_workbook, PREFIX, REL
+from helpers.themetint_to_rgb import theme_and_tint_to_rgb, ms_rgb_to_hex_rgb
+
+# shape is (rows, columns). values is a list of rows of SharedString, formats maps (row, col) to the
+# format dict style_tbl() expects, and merges holds 1-based (min_row, min_col, max_row, max_col) ranges
+SheetData = namedtuple('SheetData', ['name', 'shape', 'values', 'formats', 'merges'])
+
+
+def sheet_names(source):
+    '''
+    Names of the worksheets in source, in workbook order. Chartsheets have no cells and are left out,
+    as custom_load_workbook() does
+    '''
+    container = open_package(source)
+    workbook = ET.parse(container.open('xl/workbook.xml'))
+    rels = ET.parse(container.open('xl/_rels/workbook.xml.rels'))
+    targets = {rel.attrib['Id']: rel.attrib['Target'] for rel in rels.getroot()}
+    return [
+        sheet.attrib['name'] for sheet in workbook.getroot().findall(PREFIX + 'sheets/' + PREFIX + 'sheet')
+        if 'worksheets/' in targets[sheet.attrib[REL + 'id']]
+    ]
+
+
+def convert_sheets(source, names=None, max_workers=None):
+    '''
+    Converts worksheets of the Excel source to SheetData, in workbook order.
+
+    With more than one sheet, sheets are converted in parallel across processes. The sheets are split
+    into one contiguous chunk per worker, and each worker loads the workbook once for its own chunk.
+    custom_load_workbook() only parses the chunk's sheets.
+
+    Parameters
+    ----------
+    source : str
+        The file location of the Excel source
+    names : str or list
+        Sheet name(s) to convert (default is every worksheet)
+    max_workers : int
+        Size of the conversion pool (default is the number of CPUs). 1 converts in this process
+    '''
+    all_names = sheet_names(source)
+    if names is None:
+        names = all_names
+    else:
+        names = [names] if isinstance(names, str) else list(names)
+        missing = [name for name in names if name not in all_names]
+        if missing:
+            raise KeyError(f'Worksheet(s) {missing} not found in {source}. Sheets are: {all_names}')
+        names = [name for name in all_names if name in names]
+
+    if len(names) <= 1 or max_workers == 1:
+        wb = load_workbook(open_package(source).stream(), data_only=True)
+        text_wb = custom_load_workbook(source, sheets=names)
+        return [convert_sheet(wb, text_wb, name) for name in names]
+
+    source = os.path.realpath(source)
+    workers = min(max_workers or os.cpu_count() or 1, len(names))
+    size, extra = divmod(len(names), workers)
+    chunks = []
+    for i in range(workers):
+        start = i * size + min(i, extra)
+        chunks.append(names[start:start + size + (i < extra)])
+    with process_pool(max_workers=workers) as pool:
+        return [sheet for chunk in pool.map(_convert_in_worker, [source] * workers, chunks) for sheet in chunk]
+
+
+def convert_sheet(wb, text_wb, name):
+    '''
+    Converts one worksheet to SheetData
+
+    Parameters
+    ----------
+    wb : openpyxl Workbook
+        Source of the table size, cell formats and merged ranges
+    text_wb : Workbook
+        custom_load_workbook() of the same file, source of the cell text runs (for subscript and superscript support)
+    name : str
+        The worksheet to convert
+    '''
+    ws = wb[name]
+    text_ws = text_wb.sheets[name]
+    shape = (ws.max_row, ws.max_column)
+
+    # Store cell contents in an array
+    values = [[text_ws.cell(r, c).value for c in range(1, shape[1] + 1)] for r in range(1, shape[0] + 1)]
+
+    # Store dict of formats
+    formats = {}
+    for r, row in enumerate(ws.iter_rows(max_row=shape[0], max_col=shape[1])):
+        for c, cell in enumerate(row):
+            formats[(r, c)] = {
+                'bold': cell.font.b,
+                'italic': cell.font.i,
+                'name': cell.font.name,
+                'size': cell.font.size,
+                'fillColor': _color(wb, cell.fill.start_color),
+                'fontColor': _color(wb, cell.font.color),
+                'horizontal': cell.alignment.horizontal,
+                'vertical': cell.alignment.vertical,  # can build overrides
+                'border': {
+                    'top': cell.border.top.style,
+                    'topColor': _color(wb, cell.border.top.color),
+                    'bottom': cell.border.bottom.style,
+                    'bottomColor': _color(wb, cell.border.bottom.color),
+                    'left': cell.border.left.style,
+                    'leftColor': _color(wb, cell.border.left.color),
+                    'right': cell.border.right.style,
+                    'rightColor': _color(wb, cell.border.right.color),
+                }
+            }
+
+    merges = [(rng.min_row, rng.min_col, rng.max_row, rng.max_col) for rng in ws.merged_cells.ranges]
+    return SheetData(name, shape, values, formats, merges)
+
+
+def _convert_in_worker(source, names):
+    # openpyxl's read-only mode has no merged cells, so the full workbook is loaded, once per chunk
+    wb = load_workbook(open_package(source).stream(), data_only=True)
+    text_wb = custom_load_workbook(source, sheets=names)
+    return [convert_sheet(wb, text_wb, name) for name in names]
+
+
+def _color(wb, color_meta):
+    '''
+    Excel colour (theme, rgb or indexed, with tint) as a Word hex colour
+    '''
+    if color_meta is None:
+        return
+    tint = color_meta.tint
+    if color_meta.type == 'theme':
+        theme = color_meta.theme
+        fillcolor = theme_and_tint_to_rgb(wb, theme, tint)
+    elif color_meta.type == 'rgb':
+        ms_rgb = color_meta.rgb
+        fillcolor = ms_rgb_to_hex_rgb(ms_rgb, tint)
+    elif color_meta.type == 'indexed':
+        index = color_meta.indexed
+        ms_rgb = styles.colors.COLOR_INDEX[index]
+        if 'Foreground' in ms_rgb:
+            ms_rgb = '00000000'  # Black
+        else:
+            ms_rgb = 'FF000000' # White
+        fillcolor = ms_rgb_to_hex_rgb(ms_rgb, tint)
+    else:
+        raise TypeError(f'Unrecognised color-type: "{color_meta.type}". Check classes')
+    return fillcolor
@@ -1,3 +1,6 @@
+import copy
+
+from lxml import etree
 import docx  # To read docx and extract data
 from docx.oxml import OxmlElement  # For defining and targeting xml elements to change
 from docx.oxml.ns import qn  # For defining and targeting xml elements to change
@@ -5,10 +8,17 @@ from docx.enum.section import WD_SECTION  # To get word sections
 from docx.text.paragraph import Paragraph
 from docxcompose.composer import Composer  # Append files together, preserving everything except sections
 
+# sectPr children that must come after w:cols (ECMA-376 17.6.17)
+SECT_PR_AFTER_COLS = ('formProt', 'vAlign', 'noEndnote', 'titlePg', 'textDirection', 'bidi', 'rtlGutter', 'docGrid', 'printerSettings', 'sectPrChange')
+
 # Helper functions
-def get_para_data(dest, src_p):
+def get_para_data(dest, src_p, registry=None, footnotes=None):
     """
     Write the run to the new file and then set its font, bold, alignment, color etc. data.
+
+    If a CharStyleRegistry is given, runs reference a shared character style instead of
+    carrying their own direct formatting. If a FootnoteCopier is given, footnotes are copied
+    whole through its index (call its flush() once the source is done) instead of add_footnote().
     
     More text attributes: https://python-docx.readthedocs.io/en/latest/api/text.html
     """
@@ -18,6 +28,23 @@ def get_para_data(dest, src_p):
         
         dest_run = dest_para.add_run(run.text)
         
+        if registry is not None:
+            base = run.style.name if run._r.style else None
+            registry.apply(
+                dest_run,
+                base=base,
+                bold=run.bold,
+                italic=run.italic,
+                underline=run.underline,
+                color=run.font.color.rgb,
+                name=run.font.name,
+                size=run.font.size,
+                subscript=run.font.subscript,
+                superscript=run.font.superscript,
+            )
+            _copy_footnote(dest_para, dest_run, run, footnotes)
+            continue
+
         # Apply text styles
         dest_run.bold = run.bold
         dest_run.italic = run.italic
@@ -30,16 +57,115 @@ def get_para_data(dest, src_p):
         dest_run.font.size = run.font.size
         
         # Add run for footnote
-        if run.footnote:
-            dest_para.add_footnote(run.footnote)
+        _copy_footnote(dest_para, dest_run, run, footnotes)
         
     # Align paragraph
     dest_para.alignment = src_p.alignment
+
+
+def _copy_footnote(dest_para, dest_run, run, footnotes):
+    """
+    Carry over the footnote referenced by run, if any
+    """
+    footnote_id = run._r.footnote_id
+    if footnote_id is None:
+        return
+    if footnotes is not None:
+        footnotes.reference(dest_run, run.part, footnote_id)
+    else:
+        dest_para.add_footnote(run.footnote)
         
 
-def new_section_cols(dest, num_cols):
+def section_cols(dest):
+    """
+    Number of columns in the destination's current (last) section
+    """
+    cols = dest.element.body.sectPr.find(qn('w:cols'))
+    if cols is None or cols.get(qn('w:num')) is None:
+        return 1
+    return int(cols.get(qn('w:num')))
+
+
+def new_section_cols(dest, num_cols, current=None):
+    """
+    Start a new continuous section with num_cols columns.
+
+    If current (the column count already in effect) matches, no break is added and
+    the existing section simply continues. Returns the column count now in effect.
+    """
+    num_cols = int(num_cols)
+    if current is not None and int(current) == num_cols:
+        return num_cols
+
     new_section = dest.add_section(WD_SECTION.CONTINUOUS)
     sectPr = new_section._sectPr
+    # Replace rather than append, the last section's sectPr is reused for every new section
+    for old_cols in sectPr.findall(qn('w:cols')):
+        sectPr.remove(old_cols)
     cols = OxmlElement('w:cols')
     cols.set(qn('w:num'), str(num_cols))
-    sectPr.append(cols)
\ No newline at end of file
+    # Schema order: cols comes before these elements in a sectPr
+    following = [sectPr.find(qn(f'w:{tag}')) for tag in SECT_PR_AFTER_COLS]
+    following = [el for el in following if el is not None]
+    if following:
+        following[0].addprevious(cols)
+    else:
+        sectPr.append(cols)
+    return num_cols
+
+
+def merge_sections(doc):
+    """
+    Post-pass that merges adjacent sections with identical properties.
+
+    A section ends at the paragraph holding its sectPr, so dropping that sectPr folds the section
+    into the next one. Paragraphs that only existed to carry the break are removed as well.
+    Works on any python-docx Document or DocxTemplate, e.g. an existing output file:
+
+        doc = docx.Document(path)
+        print(merge_sections(doc))
+        doc.save(path)
+
+    Returns
+    -------
+    report : dict
+        Section count and document.xml size before and after
+    """
+    body = doc.element.body
+    bytes_before = len(etree.tostring(doc.element))
+
+    sections = []
+    for p in body.iterchildren(qn('w:p')):
+        sectPr = p.find(qn('w:pPr') + '/' + qn('w:sectPr'))
+        if sectPr is not None:
+            sections.append((p, sectPr))
+    sections.append((None, body.sectPr))
+    count_before = len(sections)
+
+    removed = 0
+    for (p, sectPr), (_, next_sectPr) in zip(sections, sections[1:]):
+        if next_sectPr is None or _section_key(sectPr) != _section_key(next_sectPr):
+            continue
+        pPr = sectPr.getparent()
+        pPr.remove(sectPr)
+        if len(pPr) == 0 and all(child is pPr for child in p):
+            body.remove(p)
+        removed += 1
+
+    return {
+        'sections_before': count_before,
+        'sections_after': count_before - removed,
+        'bytes_before': bytes_before,
+        'bytes_after': len(etree.tostring(doc.element)),
+    }
+
+
+def _section_key(sectPr):
+    """
+    Comparable form of a sectPr, ignoring revision ids that Word sprinkles on
+    """
+    sectPr = copy.deepcopy(sectPr)
+    for el in sectPr.iter():
+        for attr in [attr for attr in el.attrib if attr.startswith(qn('w:rsid'))]:
+            del el.attrib[attr]
+    return etree.tostring(sectPr, method='c14n')
\ No newline at end of file
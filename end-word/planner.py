@@ -0,0 +1,330 @@
+'''Manifest-driven report builder
+
+Builds a report from a JSON manifest instead of file names. The manifest lists the template, backpage,
+output and context, and each section with its options:
+
+    {
+        "template": "1 template.docx",
+        "backpage": "z_backpage.docx",
+        "output": "0 output.docx",
+        "context": {"title": "...", "subtitle": "..."},
+        "sections": [
+            {"kind": "docx", "source": "sample_content_0_cols_1.docx", "columns": 1, "separate_header": true},
+            {"kind": "xlsx", "source": "sample_content_1_tbl.xlsx", "heading": "Results", "sheets": ["Jan"]},
+            {"kind": "chart", "source": "charts.xlsx", "width": 150, "height": 90}
+        ]
+    }
+
+Paths are relative to the manifest. kind is one of xlsx (tables), chart or docx, and is taken from the
+file extension when left out (.xlsx files are tables). Any other key is passed to the matching
+Assembler.append_*() method, except:
+    cost        relative conversion cost, to override the estimate from file size
+    space_after points of space after the section (default is 20 for xlsx and chart, none for docx)
+context['date'] defaults to today.
+
+File reads, conversions and appends run as a pipeline: sections are admitted in order into a bounded
+window, read by reader threads, converted by converter threads (most expensive first), and appended
+to the document strictly in manifest order as soon as they are ready.
+
+    python planner.py ../test/samples/manifest.json
+'''
+# Standard imports
+import argparse
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+
+# Third-party imports
+from docx.enum.text import WD_BREAK
+from docx.shared import Pt
+from docxtpl import DocxTemplate
+
+# Local imports
+from assembler import Assembler
+from helpers.archive import preload
+from helpers.chart import read_charts, render_charts
+from helpers.docx_stream import DocxStream
+from helpers.sheets import convert_sheets
+
+KINDS = ('xlsx', 'chart', 'docx')
+# Rough conversion cost per byte of source file, relative to copying a Word document.
+# Only the order matters - it decides which sections are converted first
+KIND_COST = {'xlsx': 4.0, 'chart': 8.0, 'docx': 1.0}
+SPACE_AFTER = {'xlsx': 20, 'chart': 20, 'docx': None}  # Points
+
+WINDOW = 4  # Sections read or converted ahead of the one being appended
+READERS = 2
+CONVERTERS = os.cpu_count() or 1
+EPS = 1e-4  # Seconds - waits shorter than this are treated as no wait
+
+
+class Section:
+    '''
+    One manifest section and the timestamps of its trip through the pipeline
+    '''
+    def __init__(self, index, kind, source, options, cost=None, space_after=None):
+        self.index = index
+        self.kind = kind
+        self.source = source
+        self.options = options
+        self.cost = cost if cost is not None else KIND_COST[kind] * os.path.getsize(source)
+        self.space_after = space_after
+        self.admitted = self.read_start = self.read_end = None
+        self.convert_start = self.convert_end = self.append_start = self.append_end = None
+
+    @property
+    def name(self):
+        return os.path.basename(self.source)
+
+
+def load_manifest(path):
+    '''
+    Reads a build manifest, resolving paths against the manifest's folder
+
+    Returns
+    -------
+    manifest : dict
+        template, backpage, output, context and sections (a list of Section)
+    '''
+    with open(path) as fh:
+        manifest = json.load(fh)
+    base = os.path.dirname(os.path.abspath(path))
+
+    for key in ('template', 'backpage', 'output', 'sections'):
+        if key not in manifest:
+            raise ValueError(f'Manifest {path} is missing "{key}"')
+
+    sections = []
+    for index, entry in enumerate(manifest['sections']):
+        options = dict(entry)
+        source = os.path.join(base, options.pop('source'))
+        kind = options.pop('kind', None) or os.path.splitext(source)[1].lstrip('.')
+        if kind not in KINDS:
+            raise ValueError(f'Section {index} ({source}): unknown kind "{kind}", expected one of {KINDS}')
+        cost = options.pop('cost', None)
+        space_after = options.pop('space_after', SPACE_AFTER[kind])
+        sections.append(Section(index, kind, source, options, cost, space_after))
+
+    context = dict(manifest.get('context', {}))
+    context.setdefault('date', datetime.date.today())
+    return {
+        'template': os.path.join(base, manifest['template']),
+        'backpage': os.path.join(base, manifest['backpage']),
+        'output': os.path.join(base, manifest['output']),
+        'context': context,
+        'sections': sections,
+    }
+
+
+def convert(section):
+    '''
+    The conversion step of a section, everything that does not touch the destination document
+    '''
+    options = section.options
+    if section.kind == 'xlsx':
+        return convert_sheets(section.source, options.get('sheets'), max_workers=options.get('max_workers'))
+    if section.kind == 'chart':
+        size = (options.get('width', 150), options.get('height', 90))
+        return render_charts(read_charts(section.source), fmt='png', size=size)
+    # Word sources are streamed by append_docx, so only the styles and relationships are read here
+    return DocxStream(section.source)
+
+
+class Planner:
+    '''Builds the report described by a manifest through a read -> convert -> append pipeline
+
+    Parameters
+    ----------
+    manifest : dict
+        From load_manifest()
+    window : int
+        Sections allowed in flight (read or converted but not yet appended). Within the window the
+        most expensive conversions start first. Bounds memory; None lets every section in at once
+    readers, converters : int
+        Threads reading source files and converting sections. Excel sheets and charts are further
+        spread over processes by the converters themselves
+    '''
+    def __init__(self, manifest, window=WINDOW, readers=READERS, converters=CONVERTERS):
+        self.manifest = manifest
+        self.sections = manifest['sections']
+        self.window = window or len(self.sections) or 1
+        self.readers = readers
+        self.converters = converters
+        self.timings = {}
+
+    def build(self):
+        start = time.perf_counter()
+        dest = DocxTemplate(self.manifest['template'])  # Setup template
+        dest.add_paragraph().add_run().add_break(WD_BREAK.PAGE)  # Go to a new page
+        assembler = Assembler(dest, self.manifest['context'], self.manifest['backpage'], self.manifest['output'])
+        self.timings['start'] = start
+        self.timings['setup'] = time.perf_counter()
+
+        slots = threading.Semaphore(self.window)
+        reads = queue.Queue(maxsize=self.window)
+        converts = queue.PriorityQueue(maxsize=self.window + self.converters)
+        results = {}
+        ready = threading.Condition()
+        stop = threading.Event()
+        readers_left = [self.readers]
+        readers_lock = threading.Lock()
+
+        def feed():
+            # Admit sections in append order, so the window always holds the next ones to append
+            for section in self.sections:
+                slots.acquire()
+                if stop.is_set():
+                    break
+                section.admitted = time.perf_counter()
+                reads.put(section)
+            for _ in range(self.readers):
+                reads.put(None)
+
+        def read():
+            while True:
+                section = reads.get()
+                if section is None:
+                    break
+                section.read_start = time.perf_counter()
+                try:
+                    preload(section.source)
+                except Exception as e:
+                    finish(section, e)
+                    continue
+                section.read_end = time.perf_counter()
+                converts.put((-section.cost, section.index, section))
+            with readers_lock:
+                readers_left[0] -= 1
+                last = readers_left[0] == 0
+            if last:
+                for i in range(self.converters):
+                    converts.put((float('inf'), len(self.sections) + i, None))
+
+        def work():
+            while True:
+                _, _, section = converts.get()
+                if section is None:
+                    break
+                section.convert_start = time.perf_counter()
+                try:
+                    result = convert(section)
+                except Exception as e:
+                    result = e
+                section.convert_end = time.perf_counter()
+                finish(section, result)
+
+        def finish(section, result):
+            with ready:
+                results[section.index] = result
+                ready.notify_all()
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        threads += [threading.Thread(target=read, daemon=True) for _ in range(self.readers)]
+        threads += [threading.Thread(target=work, daemon=True) for _ in range(self.converters)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for section in self.sections:
+                with ready:
+                    while section.index not in results:
+                        ready.wait()
+                    result = results.pop(section.index)
+                if isinstance(result, Exception):
+                    raise result
+
+                section.append_start = time.perf_counter()
+                append = getattr(assembler, f'append_{section.kind}')
+                append(dest, section.source, converted=result, **section.options)
+                if section.space_after:
+                    dest.add_paragraph().paragraph_format.space_after = Pt(section.space_after)
+                section.append_end = time.perf_counter()
+                slots.release()
+        except BaseException:
+            # Let the feeder stop admitting sections; workers are daemons and finish on their own
+            stop.set()
+            for _ in self.sections:
+                slots.release()
+            raise
+
+        self.timings['publish_start'] = time.perf_counter()
+        assembler.publish()
+        self.timings['end'] = time.perf_counter()
+        return self.timings['end'] - start
+
+    def critical_path(self):
+        '''
+        The chain of steps that decided when the build finished, as (step, seconds) in time order.
+
+        Walks back from publish. An append that started as soon as the previous one ended was held up
+        by the appender, so the previous append is on the path. One that waited was held up by its own
+        section, so the path runs through that section's conversion and read - and, if it had to wait
+        to be admitted, back to the append that freed its slot in the window.
+        '''
+        timings = self.timings
+        path = [('publish', timings['end'] - timings['publish_start'])]
+        i = len(self.sections) - 1
+        while i >= 0:
+            section = self.sections[i]
+            path.append((f'append {section.name}', section.append_end - section.append_start))
+            previous_end = self.sections[i - 1].append_end if i > 0 else timings['setup']
+            if section.append_start - previous_end <= EPS or section.convert_end <= previous_end:
+                i -= 1
+                continue
+
+            # The appender was waiting for this section
+            path.append((f'convert {section.name}', section.convert_end - section.convert_start))
+            path.append((f'queued for converter {section.name}', section.convert_start - section.read_end))
+            path.append((f'read {section.name}', section.read_end - section.read_start))
+            path.append((f'queued for reader {section.name}', section.read_start - section.admitted))
+            blocker = i - self.window
+            if blocker >= 0 and section.admitted - self.sections[blocker].append_end <= EPS:
+                # Held back by a full window until section i - window was appended
+                i = blocker
+                continue
+            path.append(('waiting to be admitted', section.admitted - timings['setup']))
+            break
+        path.append(('setup', timings['setup'] - timings['start']))
+        return [(step, max(seconds, 0.0)) for step, seconds in reversed(path) if seconds > EPS or step == 'publish']
+
+    def report(self):
+        '''
+        Per-section timings and the critical path, as printable lines
+        '''
+        lines = [f"{'section':<40} {'kind':<6} {'read':>7} {'queued':>7} {'convert':>8} {'held':>7} {'append':>7}"]
+        for section in self.sections:
+            held = max(section.append_start - section.convert_end, 0.0)  # Converted, waiting its turn to append
+            lines.append(
+                f'{section.name:<40} {section.kind:<6} '
+                f'{section.read_end - section.read_start:>6.3f}s '
+                f'{section.convert_start - section.read_end:>6.3f}s '
+                f'{section.convert_end - section.convert_start:>7.3f}s '
+                f'{held:>6.3f}s '
+                f'{section.append_end - section.append_start:>6.3f}s'
+            )
+        wall = self.timings['end'] - self.timings['start']
+        lines.append(f'Critical path ({wall:.3f}s wall):')
+        for step, seconds in self.critical_path():
+            lines.append(f'  {step:<56} {seconds:>7.3f}s {seconds / wall:>6.1%}')
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('manifest', help='Path to the build manifest (JSON)')
+    parser.add_argument('--window', type=int, default=WINDOW, help='Sections in flight ahead of the append (0 for no limit)')
+    parser.add_argument('--readers', type=int, default=READERS, help='Reader threads')
+    parser.add_argument('--converters', type=int, default=CONVERTERS, help='Converter threads')
+    args = parser.parse_args(argv)
+
+    planner = Planner(load_manifest(args.manifest), window=args.window or None,
+                      readers=args.readers, converters=args.converters)
+    planner.build()
+    print(planner.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,464 @@
+'''HTML preview of a report
+
+Renders the same converted content the Assembler writes to Word - paragraphs and images from Word
+sources, one table per worksheet with the cell fills, borders and fonts that style_tbl() would apply,
+re-drawn charts, and the title page and backpage filled from the context - to one static HTML file.
+There is no docx composition and no Jinja rendering, so a full-report preview takes a fraction of a
+second and can be refreshed while the sources are being edited.
+
+Preview takes the same append_*() calls as Assembler, so it can stand in for it:
+
+    preview = Preview(template, context, backpage, 'preview.html')
+    preview.append_docx(None, 'sample_content_0_cols_1.docx', separate_header=True)
+    preview.append_xlsx(None, 'sample_content_1_tbl.xlsx')
+    preview.publish()
+
+or build the preview of a manifest (see planner.py):
+
+    python preview.py ../test/samples/manifest.json -o preview.html
+'''
+# Standard imports
+import argparse
+import base64
+import html
+import mimetypes
+import os
+import re
+import time
+
+# Third-party imports
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml.ns import qn  # For defining and targeting xml elements to change
+from docx.text.paragraph import Paragraph
+
+# Local imports
+from helpers.archive import release
+from helpers.chart import read_charts, render_charts
+from helpers.docx_stream import DocxStream
+from helpers.sheets import convert_sheets
+from planner import load_manifest, convert
+
+PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+TEXT_BOX = qn('w:txbxContent')
+FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+EMU_PER_MM = 36000
+BORDER_WIDTH = {'thin': 1, 'medium': 2, 'thick': 3}  # px, as style_tbl() maps them to 1/4, 1 and 2 pt
+ALIGN = {
+    WD_ALIGN_PARAGRAPH.CENTER: 'center',
+    WD_ALIGN_PARAGRAPH.RIGHT: 'right',
+    WD_ALIGN_PARAGRAPH.JUSTIFY: 'justify',
+}
+STYLESHEET = '''
+body { font-family: Calibri, Arial, sans-serif; font-size: 11pt; background: #e8e8e8; margin: 0; }
+.page { background: white; width: 210mm; margin: 10mm auto; padding: 20mm 25mm; box-sizing: border-box; }
+.cover, .backpage { min-height: 297mm; }
+.text-box { border-left: 3px solid #d0d0d0; padding-left: 4mm; margin: 4mm 0; }
+.columns > * { break-inside: avoid-column; }
+table { border-collapse: collapse; margin: 0 0 20pt 0; }
+td { padding: 1pt 5pt; white-space: pre-wrap; }
+img { max-width: 100%; }
+figure { margin: 6pt 0; text-align: center; }
+.footnotes { font-size: 9pt; border-top: 1px solid #999; }
+'''
+
+
+class Preview:
+    '''
+    Collects report content as HTML and writes it to output_path on publish()
+
+    Parameters
+    ----------
+    dest : str or Document
+        The title page template (file location or opened document)
+    context : dict
+        Values for the {{ placeholders }} of the template and backpage, as given to Assembler
+    backpage : str
+        The file location of the backpage
+    output_path : str
+        Where publish() writes the HTML file
+    '''
+    def __init__(self, dest, context, backpage, output_path):
+        self.context = context
+        self.backpage = backpage
+        self.output_path = output_path
+        self.template = dest
+        self.styles = DocxStream(dest).part.styles if isinstance(dest, str) else dest.styles
+        self.body = []
+        self.notes = []  # Footnote bodies as HTML, numbered across the report
+        self._note_sources = {}  # source part -> footnotes by id
+        self._css = {}  # style name -> CSS class, with its rule
+        self.sources = []
+
+    def publish(self):
+        '''
+        Writes the preview: title page, content, backpage and footnotes
+        '''
+        cover = self._page(self.template, 'cover')
+        back = self._page(self.backpage, 'backpage')
+
+        parts = [
+            '<!DOCTYPE html>',
+            '<html>',
+            '<head>',
+            '<meta charset="utf-8">',
+            f'<title>{html.escape(str(self.context.get("title", "Report preview")))}</title>',
+            '<style>' + STYLESHEET + '\n'.join(rule for _, rule in self._css.values() if rule) + '</style>',
+            '</head>',
+            '<body>',
+            cover,
+            '<div class="page">',
+            *self.body,
+        ]
+        if self.notes:
+            parts.append('<ol class="footnotes">')
+            parts += [f'<li id="fn-{i}">{note}</li>' for i, note in enumerate(self.notes, start=1)]
+            parts.append('</ol>')
+        parts += ['</div>', back, '</body>', '</html>']
+
+        with open(self.output_path, 'w', encoding='utf-8') as fh:
+            fh.write('\n'.join(parts))
+        release(self.template, self.backpage, *self.sources)  # Unmap the sources, so they can be edited again
+
+    def append_xlsx(self, dest, source, heading=None, sheets=None, max_workers=None, converted=None):
+        '''Adds each worksheet of the Excel source as an HTML table
+
+        Parameters
+        ----------
+        dest : None
+            Not used, kept so Preview can stand in for Assembler
+        source, heading, sheets, max_workers, converted
+            As for Assembler.append_xlsx()
+        '''
+        self.sources.append(source)
+        sheet_data = converted if converted is not None else convert_sheets(source, sheets, max_workers=max_workers)
+        if heading:
+            self.body.append(self._heading(heading))
+        for sheet in sheet_data:
+            self.body.append(_table(sheet))
+
+    def append_chart(self, dest, source, heading=None, width=150, height=90, converted=None):
+        '''Adds every chart in the Excel source as an embedded image
+
+        Parameters
+        ----------
+        dest : None
+            Not used, kept so Preview can stand in for Assembler
+        source, heading, width, height, converted
+            As for Assembler.append_chart()
+        '''
+        self.sources.append(source)
+        im_paths = converted if converted is not None else render_charts(read_charts(source), fmt='png', size=(width, height))
+        if heading:
+            self.body.append(self._heading(heading))
+        for im_path in im_paths:
+            with open(im_path, 'rb') as fh:
+                self.body.append(_figure(fh.read(), im_path, width, height))
+
+    def append_docx(self, dest, data, columns=1, new_page=False, separate_header=False, converted=None):
+        '''Adds the paragraphs, in-line images and footnotes of the Word source
+
+        Parameters
+        ----------
+        dest : None
+            Not used, kept so Preview can stand in for Assembler
+        data, columns, new_page, separate_header, converted
+            As for Assembler.append_docx()
+        '''
+        self.sources.append(data)
+        source = converted if converted is not None else DocxStream(data)
+        if isinstance(source, DocxStream):
+            paras = source.paragraphs()
+            image = source.image
+        else:
+            paras = source.paragraphs
+            doc_part = source.part
+
+            def image(rId):
+                image_part = doc_part.related_parts[rId]
+                return image_part.blob, os.path.basename(image_part.partname)
+
+        if new_page:
+            self.body.append('</div>\n<div class="page">')
+
+        columns = int(columns)
+        html_paras = []
+        for para_idx, para in enumerate(paras):
+            if para.text:
+                html_paras.append(self._paragraph(para))
+            for inline in para._p.iter(qn('wp:inline')):
+                blip = inline.find('.//' + qn('a:blip'))
+                extent = inline.find(qn('wp:extent'))
+                if blip is None or extent is None:
+                    continue
+                byte_data, name = image(blip.get(qn('r:embed')))
+                width, height = (int(extent.get(key)) / EMU_PER_MM for key in ('cx', 'cy'))
+                html_paras.append(_figure(byte_data, name, width, height))
+
+            # The header stays out of the columns
+            if para_idx == 0 and separate_header:
+                self.body += html_paras
+                html_paras = []
+
+        if columns > 1:
+            self.body.append(f'<div class="columns" style="column-count: {columns}">')
+            self.body += html_paras
+            self.body.append('</div>')
+        else:
+            self.body += html_paras
+
+    def _paragraph(self, para):
+        '''
+        A paragraph as HTML: its style picks the tag and class, and runs keep their direct formatting
+        '''
+        style = para.style.name if para.style is not None else 'Normal'
+        tag = _tag(style)
+        attrs = f' class="{self._style_class(style)}"'
+        if para.alignment in ALIGN:
+            attrs += f' style="text-align: {ALIGN[para.alignment]}"'
+
+        runs = []
+        for run in para.runs:
+            text = html.escape(run.text).replace('\n', '<br>')
+            footnote_id = run._r.footnote_id
+            if footnote_id is not None:
+                number = self._footnote(para.part, footnote_id)
+                if number is not None:
+                    text += f'<sup><a href="#fn-{number}">{number}</a></sup>'
+            if not text:
+                continue
+            css = []
+            if run.font.color.type is not None and run.font.color.rgb is not None:
+                css.append(f'color: #{run.font.color.rgb}')
+            if run.font.size is not None:
+                css.append(f'font-size: {run.font.size.pt:g}pt')
+            if run.font.name:
+                css.append(f"font-family: '{run.font.name}'")
+            if run.bold is not None:
+                css.append(f'font-weight: {"bold" if run.bold else "normal"}')
+            if run.italic is not None:
+                css.append(f'font-style: {"italic" if run.italic else "normal"}')
+            if run.underline:
+                css.append('text-decoration: underline')
+            if run.font.subscript:
+                text = f'<sub>{text}</sub>'
+            elif run.font.superscript:
+                text = f'<sup>{text}</sup>'
+            runs.append(f'<span style="{"; ".join(css)}">{text}</span>' if css else text)
+        return f'<{tag}{attrs}>{"".join(runs)}</{tag}>'
+
+    def _heading(self, text):
+        return f'<h1 class="{self._style_class("Heading 1")}">{html.escape(text)}</h1>'
+
+    def _style_class(self, style):
+        '''
+        CSS class for a paragraph style, with a rule from the template's definition of the style
+        (the Word report takes styles from the template, whatever the source defines)
+        '''
+        entry = self._css.get(style)
+        if entry is None:
+            name = 's-' + re.sub(r'[^a-z0-9]+', '-', style.lower()).strip('-')
+            css = _style_css(self.styles, style)
+            entry = self._css[style] = (name, f'.{name} {{ {css} }}' if css else '')
+        return entry[0]
+
+    def _footnote(self, part, footnote_id):
+        '''
+        Report-wide number of the footnote footnote_id of the source part, with its body added to the notes
+        '''
+        by_id = self._note_sources.get(part)
+        if by_id is None:
+            by_id = {}
+            try:
+                footnotes = part.part_related_by(RT.FOOTNOTES).element
+            except KeyError:
+                footnotes = None
+            if footnotes is not None:
+                for footnote in footnotes.iterchildren(qn('w:footnote')):
+                    by_id[int(footnote.get(qn('w:id')))] = footnote
+            self._note_sources[part] = by_id
+
+        footnote = by_id.get(footnote_id)
+        if footnote is None:
+            return None
+        text = ' '.join(''.join(t.text or '' for t in p.iter(qn('w:t'))) for p in footnote.iterchildren(qn('w:p')))
+        self.notes.append(html.escape(text.strip()))
+        return len(self.notes)
+
+    def _page(self, source, kind):
+        '''
+        The title page or backpage, with {{ placeholders }} filled from the context.
+        Text boxes (where the templates keep contact details) follow the paragraph they are anchored to
+        '''
+        stream = DocxStream(source) if isinstance(source, str) else None
+        paras = stream.paragraphs() if stream is not None else source.paragraphs
+        out = [f'<div class="page {kind}">']
+        for para in paras:
+            if para.text.strip():
+                out.append(self._filled(para))
+            for box in para._p.iter(TEXT_BOX):
+                # Word keeps a VML copy of each text box for older readers
+                if any(ancestor.tag == FALLBACK for ancestor in box.iterancestors()):
+                    continue
+                lines = [self._filled(Paragraph(p, para._parent)) for p in box.iterchildren(qn('w:p'))]
+                if any(lines):
+                    out.append('<div class="text-box">' + ''.join(lines) + '</div>')
+        out.append('</div>')
+        return '\n'.join(out)
+
+    def _filled(self, para):
+        '''
+        A template paragraph with its placeholders filled. Placeholders are often split across runs,
+        so the paragraph is filled as a whole and keeps only its paragraph style
+        '''
+        text = PLACEHOLDER.sub(lambda m: str(self.context.get(m.group(1), '')), para.text)
+        if not text.strip():
+            return ''
+        style = para.style.name if para.style is not None else 'Normal'
+        tag = _tag(style)
+        attrs = f' class="{self._style_class(style)}"'
+        if para.alignment in ALIGN:
+            attrs += f' style="text-align: {ALIGN[para.alignment]}"'
+        return f'<{tag}{attrs}>{html.escape(text)}</{tag}>'
+
+
+def _tag(style):
+    '''
+    HTML tag for a paragraph style: Title and Heading 1-6 become headings, anything else a paragraph
+    '''
+    if style == 'Title':
+        return 'h1'
+    match = re.fullmatch(r'Heading ([1-6])', style)
+    return f'h{match.group(1)}' if match else 'p'
+
+
+def _style_css(styles, style):
+    '''
+    CSS declarations for the font and alignment a Word paragraph style sets directly
+    '''
+    if styles is None:
+        return ''
+    try:
+        word_style = styles[style]
+    except KeyError:
+        return ''
+    css = []
+    font = word_style.font
+    if font.name:
+        css.append(f"font-family: '{font.name}'")
+    if font.size is not None:
+        css.append(f'font-size: {font.size.pt:g}pt')
+    if font.bold is not None:
+        css.append(f'font-weight: {"bold" if font.bold else "normal"}')
+    if font.italic is not None:
+        css.append(f'font-style: {"italic" if font.italic else "normal"}')
+    if font.color.type is not None and font.color.rgb is not None:
+        css.append(f'color: #{font.color.rgb}')
+    alignment = word_style.paragraph_format.alignment
+    if alignment in ALIGN:
+        css.append(f'text-align: {ALIGN[alignment]}')
+    return '; '.join(css)
+
+
+def _table(sheet):
+    '''
+    One worksheet as an HTML table, styled from the same format dicts style_tbl() reads
+    '''
+    spans = {}
+    covered = set()
+    for min_row, min_col, max_row, max_col in sheet.merges:
+        spans[(min_row - 1, min_col - 1)] = (max_row - min_row + 1, max_col - min_col + 1)
+        covered.update((r, c) for r in range(min_row - 1, max_row) for c in range(min_col - 1, max_col))
+
+    rows = []
+    for r in range(sheet.shape[0]):
+        cells = []
+        for c in range(sheet.shape[1]):
+            span = spans.get((r, c))
+            if span is None and (r, c) in covered:
+                continue
+            attrs = ''
+            if span is not None:
+                if span[0] > 1:
+                    attrs += f' rowspan="{span[0]}"'
+                if span[1] > 1:
+                    attrs += f' colspan="{span[1]}"'
+            fmt = sheet.formats[(r, c)]
+            cells.append(f'<td{attrs} style="{_cell_css(fmt)}">{_cell_text(sheet.values[r][c])}</td>')
+        rows.append('<tr>' + ''.join(cells) + '</tr>')
+    return '<table>\n' + '\n'.join(rows) + '\n</table>'
+
+
+def _cell_css(fmt):
+    css = []
+    if fmt['fillColor']:
+        css.append(f'background: #{fmt["fillColor"]}')
+    if fmt['fontColor']:
+        css.append(f'color: #{fmt["fontColor"]}')
+    if fmt['bold']:
+        css.append('font-weight: bold')
+    if fmt['name']:
+        css.append(f"font-family: '{fmt['name']}'")
+    if fmt['size']:
+        css.append(f'font-size: {fmt["size"]:g}pt')
+    if fmt['horizontal'] in ('left', 'center', 'right', 'justify'):
+        css.append(f'text-align: {fmt["horizontal"]}')
+    css.append(f'vertical-align: {"middle" if fmt["vertical"] == "center" else fmt["vertical"] or "bottom"}')
+    for side in ('top', 'bottom', 'left', 'right'):
+        width = BORDER_WIDTH.get(fmt['border'][side])
+        if width:
+            color = fmt['border'][f'{side}Color'] or '000000'
+            css.append(f'border-{side}: {width}px solid #{color}')
+    return '; '.join(css)
+
+
+def _cell_text(value):
+    '''
+    A cell's SharedString as HTML, keeping the bold, italic, underline and sub/superscript of each run
+    '''
+    out = []
+    for run in value.runs:
+        text = html.escape(run.to_string())
+        if run.attrib('vertAlign') == 'subscript':
+            text = f'<sub>{text}</sub>'
+        elif run.attrib('vertAlign') == 'superscript':
+            text = f'<sup>{text}</sup>'
+        if run.has_attr('b'):
+            text = f'<b>{text}</b>'
+        if run.has_attr('i'):
+            text = f'<i>{text}</i>'
+        if run.has_attr('u'):
+            text = f'<u>{text}</u>'
+        out.append(text)
+    return ''.join(out)
+
+
+def _figure(byte_data, name, width, height):
+    '''
+    A centred image, embedded in the page so the preview is a single file. width and height are in mm
+    '''
+    mime = mimetypes.guess_type(name)[0] or 'image/png'
+    data = base64.b64encode(byte_data).decode('ascii')
+    return (f'<figure><img src="data:{mime};base64,{data}" alt="{html.escape(os.path.basename(name))}" '
+            f'style="width: {width:.1f}mm; height: {height:.1f}mm"></figure>')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('manifest', help='Path to the build manifest (JSON), see planner.py')
+    parser.add_argument('-o', '--output', help='HTML file to write (default is the manifest output with .html)')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    manifest = load_manifest(args.manifest)
+    output = args.output or os.path.splitext(manifest['output'])[0] + '.html'
+    preview = Preview(manifest['template'], manifest['context'], manifest['backpage'], output)
+    for section in manifest['sections']:
+        append = getattr(preview, f'append_{section.kind}')
+        append(None, section.source, converted=convert(section), **section.options)
+    preview.publish()
+    print(f'Preview written to {output} in {time.perf_counter() - start:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+from collections import namedtuple
+
+from docx.oxml.ns import qn  # For defining and targeting xml elements to change
+
+# Check_styles() - layout linter for assembled reports
+# Style properties are resolved once into an index, then the document body is walked in a single
+# pass, so linting stays cheap enough to run on every build.
+
+P = qn('w:p')
+TBL = qn('w:tbl')
+R = qn('w:r')
+SECT_PR = qn('w:sectPr')
+VAL = qn('w:val')
+
+PAGE_BREAKS = ('nextPage', 'oddPage', 'evenPage')
+BLANK_LIMIT = 3  # Consecutive empty paragraphs before we call it too much blank space
+
+Issue = namedtuple('Issue', ['index', 'kind', 'message'])
+StyleInfo = namedtuple('StyleInfo', ['name', 'level', 'keep_next', 'font', 'size'])
+
+
+class StyleIndex:
+    '''
+    Effective paragraph/character style properties, resolved through basedOn chains once per document
+    '''
+    def __init__(self, styles_element):
+        self._raw = {}
+        self._resolved = {}
+        self.default_para = None
+        self.default_font = None
+        self.default_size = None
+
+        defaults = styles_element.find(qn('w:docDefaults') + '/' + qn('w:rPrDefault') + '/' + qn('w:rPr'))
+        if defaults is not None:
+            self.default_font, self.default_size = _font_size(defaults)
+
+        for style in styles_element.iterchildren(qn('w:style')):
+            style_id = style.get(qn('w:styleId'))
+            name = style.find(qn('w:name'))
+            based_on = style.find(qn('w:basedOn'))
+            pPr = style.find(qn('w:pPr'))
+            rPr = style.find(qn('w:rPr'))
+            keep_next = outline = None
+            if pPr is not None:
+                keep_next = _on_off(pPr.find(qn('w:keepNext')))
+                outline_el = pPr.find(qn('w:outlineLvl'))
+                outline = int(outline_el.get(VAL)) if outline_el is not None else None
+            font, size = _font_size(rPr) if rPr is not None else (None, None)
+            self._raw[style_id] = {
+                'name': name.get(VAL) if name is not None else style_id,
+                'based_on': based_on.get(VAL) if based_on is not None else None,
+                'level': outline,
+                'keep_next': keep_next,
+                'font': font,
+                'size': size,
+                'custom': style.get(qn('w:customStyle')) in ('1', 'true'),
+            }
+            if style.get(qn('w:type')) == 'paragraph' and style.get(qn('w:default')) in ('1', 'true'):
+                self.default_para = style_id
+
+    def get(self, style_id):
+        '''
+        Effective StyleInfo for a style id (or the default paragraph style when None)
+        '''
+        style_id = style_id or self.default_para
+        info = self._resolved.get(style_id)
+        if info is None:
+            info = self._resolve(style_id, set())
+            self._resolved[style_id] = info
+        return info
+
+    def fonts_and_sizes(self, skip_prefix=None):
+        '''
+        Every font and size the styles define - what the template allows
+        '''
+        fonts = {self.default_font}
+        sizes = {self.default_size}
+        for raw in self._raw.values():
+            if skip_prefix and raw['custom'] and raw['name'].startswith(skip_prefix):
+                continue
+            fonts.add(raw['font'])
+            sizes.add(raw['size'])
+        fonts.discard(None)
+        sizes.discard(None)
+        return fonts, sizes
+
+    def _resolve(self, style_id, seen):
+        raw = self._raw.get(style_id)
+        if raw is None or style_id in seen:
+            return StyleInfo(style_id, None, False, self.default_font, self.default_size)
+        seen.add(style_id)
+        parent = self._resolve(raw['based_on'], seen) if raw['based_on'] else None
+        level = raw['level']
+        if level is None and raw['name'].lower().startswith('heading '):
+            # Built-in headings carry their outline level in the name
+            level = int(raw['name'].split()[-1]) - 1 if raw['name'].split()[-1].isdigit() else None
+        if level is None and raw['name'].lower() == 'title':
+            level = 0
+
+        def inherit(prop, fallback):
+            if raw[prop] is not None:
+                return raw[prop]
+            return getattr(parent, prop) if parent is not None else fallback
+
+        return StyleInfo(
+            raw['name'],
+            level if level is not None and level < 9 else None,
+            bool(inherit('keep_next', False)),
+            inherit('font', self.default_font),
+            inherit('size', self.default_size),
+        )
+
+
+def check_styles(doc, template=None, start=0, end=None, skip_prefix='EW ', ranges=None):
+    '''Lints an assembled document for layout problems in a single pass over its body
+
+    Reports:
+        - orphaned headings: a heading left at the end of the document, or before a page/section break
+        - headings followed by a table without keep-with-next, so the table can drift onto the next page
+        - runs whose font or size is not one the template defines
+        - more than BLANK_LIMIT empty paragraphs in a row
+
+    Parameters
+    ----------
+    doc : Document or DocxTemplate object
+        The assembled document
+    template : Document or DocxTemplate object
+        The template to compare fonts and sizes against (default is the document itself)
+    start, end : int
+        Range of top-level paragraphs/tables to lint, e.g. just the fragment that changed (default is the whole body)
+    skip_prefix : str
+        Name prefix of generated character styles (see CharStyleRegistry), which the template does not define
+    ranges : list
+        Several (start, end) ranges to lint in one pass, e.g. every fragment that changed. Overrides start
+        and end. Styles and the body are indexed once, whatever the number of ranges
+
+    Returns
+    -------
+    issues : list of Issue(index, kind, message)
+        index is the position of the offending paragraph/table in the document body
+    '''
+    index = StyleIndex(doc.styles.element)
+    template_index = index if template is None else StyleIndex(template.styles.element)
+    allowed_fonts, allowed_sizes = template_index.fonts_and_sizes(skip_prefix)
+
+    body = doc.element.body
+    blocks = list(body.iterchildren(P, TBL))
+    if ranges is None:
+        ranges = [(start, end)]
+    page_starts = _page_breaking_sections(blocks, body)
+
+    issues = []
+    for start, end in _merge(ranges, len(blocks)):
+        pending = None  # Heading waiting to see what follows it
+        blanks = 0
+        for i in range(start, end):
+            block = blocks[i]
+
+            if block.tag == TBL:
+                if pending is not None and not pending[2]:
+                    issues.append(Issue(pending[0], 'keep-next', f'Heading "{pending[1]}" is followed by a table but is not set to keep with next'))
+                pending = None
+                blanks = 0
+                _check_fonts(block, index, allowed_fonts, allowed_sizes, i, issues)
+                continue
+
+            pPr = block.find(qn('w:pPr'))
+            style_id = None
+            direct_keep = None
+            breaks_before = False
+            sect = None
+            if pPr is not None:
+                pStyle = pPr.find(qn('w:pStyle'))
+                style_id = pStyle.get(VAL) if pStyle is not None else None
+                direct_keep = _on_off(pPr.find(qn('w:keepNext')))
+                breaks_before = bool(_on_off(pPr.find(qn('w:pageBreakBefore'))))
+                sect = pPr.find(SECT_PR)
+            info = index.get(style_id)
+            keep_next = info.keep_next if direct_keep is None else direct_keep
+            text = ''.join(t.text or '' for t in block.iter(qn('w:t'))).strip()
+            has_content = bool(text) or block.find('.//' + qn('w:drawing')) is not None
+            page_break = breaks_before or any(br.get(qn('w:type')) == 'page' for br in block.iter(qn('w:br')))
+
+            if pending is not None and page_break:
+                issues.append(Issue(pending[0], 'orphan', f'Heading "{pending[1]}" is left alone before a page break'))
+                pending = None
+
+            if has_content:
+                blanks = 0
+                pending = (i, text[:40], keep_next) if info.level is not None else None
+            elif not page_break and sect is None:
+                blanks += 1
+                if blanks == BLANK_LIMIT + 1:
+                    issues.append(Issue(i - BLANK_LIMIT, 'blank-space', f'More than {BLANK_LIMIT} empty paragraphs in a row'))
+
+            if pending is not None and sect is not None and i in page_starts:
+                issues.append(Issue(pending[0], 'orphan', f'Heading "{pending[1]}" is left alone before a section break'))
+                pending = None
+
+            _check_fonts(block, index, allowed_fonts, allowed_sizes, i, issues, info)
+
+        if pending is not None and end == len(blocks):
+            issues.append(Issue(pending[0], 'orphan', f'Heading "{pending[1]}" is the last thing in the document'))
+    return issues
+
+
+def _merge(ranges, length):
+    '''
+    Sorted (start, end) ranges clipped to the body, with overlapping or touching ranges joined so a
+    heading at the end of one fragment is checked against the start of the next
+    '''
+    merged = []
+    for start, end in sorted((start, length if end is None else min(end, length)) for start, end in ranges):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def block_count(doc):
+    '''
+    Number of top-level paragraphs and tables, the unit check_styles() ranges are measured in
+    '''
+    return sum(1 for _ in doc.element.body.iterchildren(P, TBL))
+
+
+def format_issues(issues):
+    return '\n'.join(f'[{issue.kind}] block {issue.index}: {issue.message}' for issue in issues)
+
+
+def _check_fonts(block, index, allowed_fonts, allowed_sizes, i, issues, para_info=None):
+    '''
+    Flag runs whose effective font or size is not defined by the template. Reported once per block
+    '''
+    paragraphs = [block] if block.tag == P else block.iter(P)
+    seen = set()
+    for p in paragraphs:
+        info = para_info
+        if info is None:
+            pStyle = p.find(qn('w:pPr') + '/' + qn('w:pStyle'))
+            info = index.get(pStyle.get(VAL) if pStyle is not None else None)
+        for r in p.iterchildren(R):
+            font, size = info.font, info.size
+            rPr = r.find(qn('w:rPr'))
+            if rPr is not None:
+                rStyle = rPr.find(qn('w:rStyle'))
+                if rStyle is not None:
+                    char = index.get(rStyle.get(VAL))
+                    font, size = char.font or font, char.size or size
+                direct_font, direct_size = _font_size(rPr)
+                font, size = direct_font or font, direct_size or size
+            if font and allowed_fonts and font not in allowed_fonts and ('font', font) not in seen:
+                seen.add(('font', font))
+                issues.append(Issue(i, 'font-drift', f'Font "{font}" is not used by the template'))
+            if size and allowed_sizes and size not in allowed_sizes and ('size', size) not in seen:
+                seen.add(('size', size))
+                issues.append(Issue(i, 'size-drift', f'Font size {size:g}pt is not used by the template'))
+
+
+def _page_breaking_sections(blocks, body):
+    '''
+    Indexes of paragraphs whose section break starts the next section on a new page.
+    A break's type is stored on the sectPr of the section that follows it.
+    '''
+    sect_positions = []
+    for i, block in enumerate(blocks):
+        if block.tag == P:
+            sect = block.find(qn('w:pPr') + '/' + SECT_PR)
+            if sect is not None:
+                sect_positions.append((i, sect))
+    following = [sect for _, sect in sect_positions[1:]] + [body.find(SECT_PR)]
+
+    page_starts = set()
+    for (i, _), next_sect in zip(sect_positions, following):
+        break_type = 'nextPage'  # Default when w:type is missing
+        if next_sect is not None:
+            type_el = next_sect.find(qn('w:type'))
+            if type_el is not None:
+                break_type = type_el.get(VAL)
+        if break_type in PAGE_BREAKS:
+            page_starts.add(i)
+    return page_starts
+
+
+def _font_size(rPr):
+    fonts = rPr.find(qn('w:rFonts'))
+    font = None
+    if fonts is not None:
+        font = fonts.get(qn('w:ascii')) or fonts.get(qn('w:asciiTheme'))
+    sz = rPr.find(qn('w:sz'))
+    size = int(sz.get(VAL)) / 2 if sz is not None else None  # Half-points
+    return font, size
+
+
+def _on_off(element):
+    if element is None:
+        return None
+    return element.get(VAL) not in ('0', 'false', 'off')
@@ -0,0 +1,172 @@
+from docx.enum.style import WD_STYLE_TYPE
+from docx.shared import Pt, RGBColor
+from docx.text.font import Font
+
+# Order of the run properties that make up a registry key
+PROPS = ('base', 'underline', 'color', 'name', 'size', 'subscript', 'superscript')
+
+# Toggle properties (ECMA-376 17.7.3) flip when a character style sets them on top of a paragraph style that
+# already does, e.g. bold in a character style under Heading 1 shows as not bold. They stay on the run itself
+TOGGLES = ('bold', 'italic')
+
+
+class CharStyleRegistry:
+    '''
+    Maps each distinct combination of run formatting to a named character style in the destination doc.
+
+    Instead of every copied run carrying its own rPr block (bold, italic, colour, font, size...), runs
+    reference a shared style that is created once in the styles part. This keeps document.xml small,
+    which speeds up saving and Word's layout. Bold and italic are toggle properties, so they are written
+    as direct formatting rather than folded into the style.
+    '''
+    def __init__(self, dest, prefix='EW'):
+        self.dest = dest
+        self.prefix = prefix
+        self.styles = {}  # key -> style_id
+        self._keys = {}  # style_id -> key, to merge later formatting into an already styled run
+        self.runs_styled = 0
+        self.props_avoided = 0  # Direct formatting elements that were not written
+        self.bytes_avoided = 0  # Approximate document.xml bytes saved
+        self._rpr_sizes = {}
+
+    def apply(self, run, base=None, bold=None, italic=None, underline=None, color=None, name=None,
+              size=None, subscript=None, superscript=None):
+        '''
+        Style a run with the character style for the given formatting. Formatting that is None is inherited.
+        bold and italic are set on the run directly (see TOGGLES).
+
+        run may be a docx Run or its CT_R element. If the run already references a style from this
+        registry, the new formatting is merged on top of it.
+
+        Parameters
+        ----------
+        base : str
+            Name of an existing character style to build on, e.g. 'Footnote Reference'
+        color : str or RGBColor
+            Hex colour such as 'FF0000'
+        size : float or Length
+            Font size in points, or a docx Length
+        '''
+        r = getattr(run, '_r', run)
+        font = Font(r)
+        for prop, value in (('bold', bold), ('italic', italic)):
+            if value is not None:
+                setattr(font, prop, value)
+
+        props = {
+            'base': base, 'underline': underline,
+            'color': str(color).upper()[-6:] if color is not None else None,  # Drop any alpha from ARGB
+            'name': name,
+            'size': float(size.pt if hasattr(size, 'pt') else size) if size else None,
+            'subscript': subscript, 'superscript': superscript,
+        }
+
+        current = r.style
+        if current in self._keys:
+            merged = dict(zip(PROPS, self._keys[current]))
+            merged.update({prop: value for prop, value in props.items() if value is not None})
+            props = merged
+        elif current and props['base'] is None:
+            props['base'] = self.dest.styles.get_by_id(current, WD_STYLE_TYPE.CHARACTER).name
+
+        if props['base'] and props['base'] not in self.dest.styles:
+            # The template must define every style used (see README). Fall back to the default font
+            props['base'] = None
+
+        key = tuple(props[prop] for prop in PROPS)
+        if all(value is None for value in key[1:]):
+            # Nothing beyond the base style, so no generated style is needed
+            if props['base']:
+                r.style = self.dest.styles[props['base']].style_id
+            return
+
+        style_id = self.styles.get(key)
+        if style_id is None:
+            style_id = self._add_style(key)
+        r.style = style_id
+
+        self.runs_styled += 1
+        self.props_avoided += sum(1 for value in key[1:] if value is not None)
+        self.bytes_avoided += self._rpr_size(key) - len(f'<w:rPr><w:rStyle w:val="{style_id}"/></w:rPr>')
+
+    def report(self):
+        '''
+        Summary of what the registry saved, compared to writing direct formatting on every run
+        '''
+        return {
+            'runs_styled': self.runs_styled,
+            'styles_created': len(self.styles),
+            'props_avoided': self.props_avoided,
+            'bytes_avoided': self.bytes_avoided,
+        }
+
+    def _add_style(self, key):
+        props = dict(zip(PROPS, key))
+        name = self._style_name(props)
+        styles = self.dest.styles
+        try:
+            # Reuse a style left over from an earlier run on the same template
+            style = styles[name]
+        except KeyError:
+            style = styles.add_style(name, WD_STYLE_TYPE.CHARACTER)
+            if props['base']:
+                style.base_style = styles[props['base']]
+            font = style.font
+            font.underline = props['underline']
+            font.name = props['name']
+            font.subscript = props['subscript']
+            font.superscript = props['superscript']
+            if props['size']:
+                font.size = Pt(props['size'])
+            if props['color']:
+                font.color.rgb = RGBColor.from_string(props['color'])
+
+        self.styles[key] = style.style_id
+        self._keys[style.style_id] = key
+        return style.style_id
+
+    def _style_name(self, props):
+        parts = [self.prefix]
+        if props['base']:
+            parts.append(props['base'])
+        for prop in ('underline', 'subscript', 'superscript'):
+            value = props[prop]
+            if value is None:
+                continue
+            if value is True or value is False:
+                parts.append(prop.capitalize() if value else f'No{prop.capitalize()}')
+            else:
+                # Underline types such as WD_UNDERLINE.DOUBLE
+                parts.append(f'{prop.capitalize()}{getattr(value, "name", value).title()}')
+        if props['name']:
+            parts.append(props['name'])
+        if props['size']:
+            parts.append(f"{props['size']:g}pt")
+        if props['color']:
+            parts.append(f"#{props['color']}")
+        return ' '.join(parts)
+
+    def _rpr_size(self, key):
+        '''
+        Length of the rPr block that direct formatting would have written for this key
+        '''
+        size = self._rpr_sizes.get(key)
+        if size is None:
+            props = dict(zip(PROPS, key))
+            xml = '<w:rPr>'
+            if props['base']:
+                xml += f'<w:rStyle w:val="{props["base"]}"/>'
+            if props['name']:
+                xml += f'<w:rFonts w:ascii="{props["name"]}" w:hAnsi="{props["name"]}"/>'
+            if props['color']:
+                xml += f'<w:color w:val="{props["color"]}"/>'
+            if props['size']:
+                xml += f'<w:sz w:val="{int(props["size"] * 2)}"/>'
+            if props['underline'] is not None:
+                xml += '<w:u w:val="single"/>'
+            if props['subscript'] or props['superscript']:
+                xml += '<w:vertAlign w:val="superscript"/>'
+            xml += '</w:rPr>'
+            size = len(xml)
+            self._rpr_sizes[key] = size
+        return size
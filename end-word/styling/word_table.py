@@ -1,7 +1,7 @@
 from docx.oxml import OxmlElement  # For defining and targeting xml elements to change
 from docx.oxml.ns import qn  # For defining and targeting xml elements to change
 
-def style_tbl(table, xls_formats):
+def style_tbl(table, xls_formats, registry=None):
     tbl = table._tbl # get xml element of the table
     merged_cell_flag = False  # initiate merged cell flag to mark if cell is part of marged group
     merged_cell_count = 0  # initiate counter for merged cells
@@ -19,7 +19,7 @@ def style_tbl(table, xls_formats):
         # Run style changes
         _borders(cell, tcPr, xls_formats[coord])
         _fill_align(cell, tcPr, xls_formats[coord])
-        _fonts(cell,  tcPr, xls_formats[coord])
+        _fonts(cell,  tcPr, xls_formats[coord], registry)
 
 
 def _borders(cell, tcPr, xls_format):
@@ -71,13 +71,23 @@ def _fill_align(cell, tcPr, xls_format):
         pass
     
     
-def _fonts(cell, tcPr, xls_format):
+def _fonts(cell, tcPr, xls_format, registry=None):
     # https://python-docx.readthedocs.io/en/latest/dev/analysis/features/text/font-color.html
     try:
         run = cell.p_lst[0].r_lst[0]
     except IndexError:
         # print(f'IndexError: No run in cell {coord} - skipping')
         return
+    # Shared character style instead of a direct rPr block on the run
+    if registry is not None:
+        registry.apply(
+            run,
+            bold=True if xls_format['bold'] else None,
+            color=xls_format['fontColor'] or None,
+            name=xls_format['name'] or None,
+            size=xls_format['size'] or None,
+        )
+        return
     rPr = run._add_rPr()
     # Set font color
     if xls_format['fontColor']:
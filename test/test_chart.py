@@ -0,0 +1,63 @@
+# Chart series read from workbooks without cached values, as openpyxl writes them
+# Run from the repo root with: python -m pytest test
+import math
+import os
+import sys
+
+import openpyxl
+from openpyxl.chart import BarChart, Reference
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'end-word'))
+from helpers.archive import release  # noqa: E402
+from helpers.chart import read_charts  # noqa: E402
+from helpers.excel import custom_load_workbook  # noqa: E402
+
+
+def _workbook(path):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Data sheet'
+    for row in (('Year', 'Sales', 'Costs'), (2019, 10, 4), (2020, 12, None), (2021, 15, 7)):
+        ws.append(row)
+    for rw in range(12, 15):
+        ws.cell(row=rw, column=1, value=rw)
+    chart = BarChart()
+    chart.add_data(Reference(ws, min_col=2, min_row=1, max_col=3, max_row=4), titles_from_data=True)
+    chart.set_categories(Reference(ws, min_col=1, min_row=2, max_row=4))
+    ws.add_chart(chart, 'E2')
+    wb.save(path)
+
+
+def test_uncached_series_resolve_through_the_workbook(tmp_path):
+    path = str(tmp_path / 'chart.xlsx')
+    _workbook(path)
+    try:
+        [spec] = read_charts(path)
+    finally:
+        release(path)
+
+    sales, costs = spec['groups'][0]['series']
+    assert (sales['name'], costs['name']) == ('Sales', 'Costs')
+    assert sales['categories'] == ['2019', '2020', '2021']
+    assert sales['values'] == [10.0, 12.0, 15.0]
+    assert costs['values'][0] == 4.0 and math.isnan(costs['values'][1])
+
+
+def test_get_range(tmp_path):
+    path = str(tmp_path / 'chart.xlsx')
+    _workbook(path)
+    try:
+        ws = custom_load_workbook(path).active
+    finally:
+        release(path)
+
+    def text(cells):
+        return [[c.value.plain_text() for c in row] if isinstance(row, list) else row.value.plain_text()
+                for row in cells]
+
+    assert text(ws.get_range('A2')) == ['2019']
+    assert text(ws.get_range('B1:C1')) == ['Sales', 'Costs']
+    assert text(ws.get_range('1:2')) == [['Year', 'Sales', 'Costs'], ['2019', '10', '4']]
+    assert text(ws.get_range('12:13')) == [['12', '', ''], ['13', '', '']]
+    assert text(ws.get_range('A:A'))[-3:] == ['12', '13', '14']
+    assert ws.get_range('2:1') == []
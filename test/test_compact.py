@@ -0,0 +1,56 @@
+# compact_runs(): merging runs and dropping run properties the paragraph style already sets
+# Run from the repo root with: python -m pytest test
+import os
+import sys
+
+import docx
+from docx.shared import Pt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'end-word'))
+from helpers.compact import compact_runs  # noqa: E402
+
+
+def _document():
+    doc = docx.Document()
+    normal = doc.styles['Normal']
+    normal.font.size = Pt(11)
+    normal.font.name = 'Arial'
+    return doc
+
+
+def test_strips_properties_the_style_sets():
+    doc = _document()
+    run = doc.add_paragraph().add_run('restated')
+    run.font.size = Pt(11)
+    run.font.name = 'Arial'
+
+    report = compact_runs(doc)
+
+    assert report['props_removed'] == 2
+    assert run._r.rPr is None
+
+
+def test_keeps_properties_that_differ():
+    doc = _document()
+    run = doc.add_paragraph().add_run('bigger')
+    run.font.size = Pt(14)
+    run.font.name = 'Arial'
+
+    report = compact_runs(doc)
+
+    assert report['props_removed'] == 1
+    assert run.font.size == Pt(14)
+    assert run.font.name is None
+
+
+def test_merges_runs_with_the_same_formatting():
+    doc = _document()
+    para = doc.add_paragraph()
+    for text in ('one ', 'two ', 'three'):
+        para.add_run(text).bold = True
+    para.add_run(' plain')
+
+    report = compact_runs(doc)
+
+    assert report['runs_merged'] == 2
+    assert [(run.text, run.bold) for run in para.runs] == [('one two three', True), (' plain', None)]
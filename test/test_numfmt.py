@@ -0,0 +1,130 @@
+# Excel number format cases: format code, cell value -> the text Excel shows
+# Run from the repo root with: python -m pytest test
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'end-word'))
+from helpers.numfmt import NumberFormats, compile_format  # noqa: E402
+
+CASES = [
+    # General
+    ('General', 0, '0'),
+    ('General', 42, '42'),
+    ('General', -7, '-7'),
+    ('General', 0.1, '0.1'),
+    ('General', 1 / 3, '0.3333333333'),
+    ('General', 123456789012, '1.23457E+11'),
+    ('General', 0.0000000001, '1E-10'),
+    # Fixed point and thousands
+    ('0', 12.5, '13'),
+    ('0', -12.5, '-13'),
+    ('0.00', 2.675, '2.68'),
+    ('0.00', -0.001, '0.00'),
+    ('#,##0', 1234567, '1,234,567'),
+    ('#,##0.00', -1234.5, '-1,234.50'),
+    ('#,##0,', 1234567, '1,235'),
+    ('#,##0,,"M"', 1234567, '1M'),
+    ('000', 7, '007'),
+    ('#.##', 3.1, '3.1'),
+    ('0.0#', 3, '3.0'),
+    # Percent and scientific
+    ('0%', 0.256, '26%'),
+    ('0.00%', 0.5, '50.00%'),
+    ('0.00E+00', 12345, '1.23E+04'),
+    ('0.00E+00', 0.00012, '1.20E-04'),
+    ('##0.0E+0', 12345, '12.3E+3'),
+    # Fractions
+    ('# ?/?', 1.5, '1 1/2'),
+    ('# ??/??', 0.75, '3/4'),
+    ('# ?/4', 2.25, '2 1/4'),
+    ('# ?/4', 2.99, '3'),
+    ('# ?/8', 0.3, '2/8'),
+    ('# ?/10', 1.55, '1 6/10'),
+    ('# ??/??', 3.14159, '3 14/99'),
+    ('0/0', 3.5, '7/2'),
+    # Literals, currency and padding
+    ('"$"#,##0.00', 1234.5, '$1,234.50'),
+    ('[$€-407]#,##0.00', 10, '€10.00'),
+    ('0.0 "kg"', 2.5, '2.5 kg'),
+    ('#,##0_);(#,##0)', 5, '5'),
+    ('@', 5, '5'),
+    # Sections: positive;negative;zero
+    ('#,##0 ;(#,##0)', -1234, '(1,234)'),
+    ('#,##0.00;[Red](#,##0.00)', -2.5, '(2.50)'),
+    ('0;-0;"zero"', 0, 'zero'),
+    ('0;"neg"', -3, 'neg'),
+    ('0.00;0.00', -3, '3.00'),
+    # Empty sections hide the values they cover
+    ('#,##0;(#,##0);', 0, ''),
+    ('#,##0;(#,##0);', 5, '5'),
+    ('#,##0;;"-"', -4, ''),
+    ('#,##0;;"-"', 0, '-'),
+    ('0;;', -1, ''),
+    (';;;', 5, ''),
+    ('0;[Red]', -3, ''),
+    # Conditional sections
+    ('[>=1000]#,##0;0.00', 12.5, '12.50'),
+    ('[>=1000]#,##0;0.00', 1234.5, '1,235'),
+    ('[>=1000]#,##0;0.00', -3, '-3.00'),
+    ('[Red][<=100]0;[Blue][>100]0.0', 150, '150.0'),
+    ('[<=100]0;[>100]0.0;"other"', -4, '-4'),
+    ('[<0]"neg";0', -5, 'neg'),
+    ('[=1]"one";0', 1, 'one'),
+    ('[<>1]0.0;0', 2, '2.0'),
+    ('"[>5]"0', 3, '[>5]3'),
+    # Dates and times (1900 date system)
+    ('m/d/yyyy', 44197, '1/1/2021'),
+    ('d-mmm-yy', 44197, '1-Jan-21'),
+    ('dddd, mmmm d', 44197, 'Friday, January 1'),
+    ('mmmmm', 44197, 'J'),
+    ('yyyy-mm-dd', 59, '1900-02-28'),
+    ('yyyy-mm-dd', 60, '1900-02-29'),  # Excel's fake leap day
+    ('dddd', 60, 'Wednesday'),
+    ('yyyy-mm-dd', 61, '1900-03-01'),
+    ('h:mm', 0.5, '12:00'),
+    ('h:mm AM/PM', 0.75, '6:00 PM'),
+    ('h:mm:ss', 0.999999999, '0:00:00'),
+    ('hh:mm:ss.00', 0.5 + 1.5 / 86400, '12:00:01.50'),
+    ('[h]:mm:ss', 1.5, '36:00:00'),
+    ('mm:ss', 1 / 1440, '01:00'),
+    ('m/d/yyyy', -1, '########'),
+]
+
+
+@pytest.mark.parametrize('code, value, expected', CASES)
+def test_format(code, value, expected):
+    assert compile_format(code)(value) == expected
+
+
+def test_date1904():
+    formats = NumberFormats({164: 'yyyy-mm-dd'}, date1904=True)
+    assert formats.formatter(164)(0) == '1904-01-01'
+
+
+BUILTIN_CASES = [
+    (5, -1234.5, '($1,235)'),
+    (6, 1234.5, '$1,235'),
+    (7, 1234.5, '$1,234.50'),
+    (8, -1234.5, '($1,234.50)'),
+    (41, 1234.5, '1,235'),
+    (41, 0, '-'),
+    (42, -1234.5, '$(1,235)'),
+    (43, 1234.5, '1,234.50'),  # Comma Style
+    (43, -1234.5, '(1,234.50)'),
+    (43, 0, '-'),
+    (44, 1234.5, '$1,234.50'),
+    (44, 0, '$-'),
+]
+
+
+@pytest.mark.parametrize('format_id, value, expected', BUILTIN_CASES)
+def test_builtin_currency_and_accounting(format_id, value, expected):
+    assert NumberFormats().formatter(format_id)(value) == expected
+
+
+def test_builtin_and_unknown_ids():
+    formats = NumberFormats()
+    assert formats.format_batch(4, ['1234.5', '-2']) == ['1,234.50', '-2.00']
+    assert formats.formatter(999)(1.5) == '1.5'  # Unknown ids fall back to General
@@ -0,0 +1,50 @@
+# CharStyleRegistry: shared character styles for copied runs
+# Run from the repo root with: python -m pytest test
+import os
+import sys
+
+import docx
+from docx.enum.style import WD_STYLE_TYPE
+from docx.shared import Pt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'end-word'))
+from styling.run_styles import CharStyleRegistry  # noqa: E402
+
+
+def test_toggles_stay_on_the_run():
+    # A bold character style under the bold Heading 1 would toggle the text back to not bold
+    doc = docx.Document()
+    registry = CharStyleRegistry(doc)
+    run = doc.add_paragraph(style='Heading 1').add_run('heading')
+
+    registry.apply(run, bold=True, size=Pt(14))
+
+    assert run.bold is True
+    style = doc.styles.get_by_id(run._r.style, WD_STYLE_TYPE.CHARACTER)
+    assert style.font.bold is None
+    assert style.font.size == Pt(14)
+
+
+def test_toggles_alone_need_no_style():
+    doc = docx.Document()
+    registry = CharStyleRegistry(doc)
+    run = doc.add_paragraph().add_run('plain')
+
+    registry.apply(run._r, italic=False)
+
+    assert run.italic is False
+    assert run._r.style is None
+    assert registry.report()['styles_created'] == 0
+
+
+def test_same_formatting_shares_a_style():
+    doc = docx.Document()
+    registry = CharStyleRegistry(doc)
+    para = doc.add_paragraph()
+    first, second = para.add_run('a'), para.add_run('b')
+
+    registry.apply(first, color='0D415E', name='Arial')
+    registry.apply(second, color='ff0D415E', name='Arial', bold=True)
+
+    assert first._r.style == second._r.style
+    assert registry.report()['styles_created'] == 1